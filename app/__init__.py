@@ -1,70 +1,78 @@
 from __future__ import annotations
 
+import click
+import functools
+import importlib
 from flask import Flask
 import re
 import os
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
 from .config import Config
-from .db import db, db_session
-from sqlalchemy import text
-
-from .main.routes import bp as main_bp
-from .auth.routes import bp as auth_bp
-from .news.routes import bp as news_bp
-from .gen.routes import bp as gen_bp
-from .billing import bp as billing_bp
-from flask_wtf.csrf import CSRFProtect, CSRFError
+from .db import bulk_update_where, db, db_session
+from sqlalchemy import text, update
+
 from .limiter import limiter
 
+if TYPE_CHECKING:
+    from alembic.config import Config as AlembicConfig
+    from flask_wtf.csrf import CSRFProtect
 
-def create_app() -> Flask:
-    app = Flask(__name__, instance_relative_config=False)
-    app.config.from_object(Config())
-    # Increase max upload size to 50 MB for file-based generation
-    app.config.setdefault("MAX_CONTENT_LENGTH", 50 * 1024 * 1024)
+# (module, config flag) pairs; a flagged blueprint is only imported when its flag is truthy
+_BLUEPRINTS: tuple[tuple[str, str | None], ...] = (
+    (".main.routes", None),
+    (".auth.routes", None),
+    (".news.routes", None),
+    (".gen.routes", None),
+    (".billing", "BILLING_ENABLED"),
+)
 
-    # SQLite doesn't support the same pooling options as Postgres; avoid passing them.
-    try:
-        uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
-        if isinstance(uri, str) and uri.startswith("sqlite"):
-            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
-    except Exception:
-        pass
+# Flask CLI commands that serve or exercise HTTP requests and so need CSRF/limiter setup
+_HTTP_CLI_COMMANDS = frozenset({"run", "shell", "routes"})
 
-    # Derive cookie security from APP_BASE_URL to avoid "secure cookie on http"
-    # which breaks login persistence (common cause of OAuth not logging in).
-    try:
-        base = app.config.get("APP_BASE_URL", "")
-        if isinstance(base, str) and base.startswith("https://"):
-            app.config["SESSION_COOKIE_SECURE"] = True
-        elif isinstance(base, str) and base.startswith("http://"):
-            app.config["SESSION_COOKIE_SECURE"] = False
-    except Exception:
-        pass
+# Templates rendered by the error handlers in `_init_http`; warmed into the Jinja cache at startup
+_ERROR_TEMPLATES = ("billing_error.html", "rate_limited.html", "errors/404.html", "errors/500.html")
 
-    # Initialize Flask-SQLAlchemy
-    app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
-    db.init_app(app)
-    # Ensure models are imported so metadata is populated for Alembic autogenerate
-    from . import models as _models  # noqa: F401
+# Separators in an email local-part; used to derive a greeting name
+_LOCAL_PART_SPLIT = re.compile(r"[._-]+")
 
-    # Initialize Flask-Alembic to provide `flask db` commands
-    from flask_alembic import Alembic
-    import click
-    alembic = Alembic()
-    alembic.init_app(app)
+# Process-local throttle for `_update_last_seen`: user_id -> monotonic time of the last write
+_LAST_SEEN_THROTTLE_S = 30.0
+_LAST_SEEN_CACHE_MAX = 10_000
+_LAST_SEEN_CACHE: dict[str, float] = {}
+_LAST_SEEN_LOCK = threading.Lock()
+# Requests that never count as user activity
+_LAST_SEEN_SKIP_ENDPOINTS = frozenset({"static", "billing.stripe_webhook", "auth.logout"})
+_LAST_SEEN_SKIP_METHODS = frozenset({"OPTIONS", "HEAD"})
 
-    # Provide familiar `flask db` commands that proxy to Alembic directly
-    import os
-    from alembic import command as alembic_command
+
+def _wants_alembic_cli() -> bool:
+    """True when running under the `flask` CLI (or explicitly asked for `db`), never under gunicorn."""
+    return bool(os.environ.get("FLASK_RUN_FROM_CLI")) or "db" in sys.argv[1:]
+
+
+@functools.lru_cache(maxsize=1)
+def _alembic_cfg() -> AlembicConfig:
+    """Alembic config for this repo, parsed once per CLI process."""
     from alembic.config import Config as AlembicConfig
 
-    def _alembic_cfg() -> AlembicConfig:
-        repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
-        ini_path = os.path.join(repo_root, "alembic.ini")
-        cfg = AlembicConfig(ini_path)
-        cfg.set_main_option("script_location", os.path.join(repo_root, "migrations"))
-        # URL is taken from migrations/env.py via current_app; cfg url here is optional
-        return cfg
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    ini_path = os.path.join(repo_root, "alembic.ini")
+    cfg = AlembicConfig(ini_path)
+    cfg.set_main_option("script_location", os.path.join(repo_root, "migrations"))
+    # URL is taken from migrations/env.py via current_app; cfg url here is optional
+    return cfg
+
+
+def _register_alembic_cli(app: Flask) -> None:
+    """Initialize Flask-Alembic and register the `flask db` commands that proxy to Alembic."""
+    from flask_alembic import Alembic
+    from alembic import command as alembic_command
+
+    alembic = Alembic()
+    alembic.init_app(app)
 
     @app.cli.group('db')
     def db_cli():
@@ -107,25 +115,61 @@ def create_app() -> Flask:
     def db_stamp(revision: str) -> None:
         alembic_command.stamp(_alembic_cfg(), revision)
 
-    app.register_blueprint(main_bp)
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(news_bp)
-    app.register_blueprint(gen_bp)
-    app.register_blueprint(billing_bp)
+
+@functools.lru_cache(maxsize=1)
+def _csrf() -> CSRFProtect:
+    """Process-wide CSRFProtect, shared by every app instance (tests, Celery tasks)."""
+    from flask_wtf.csrf import CSRFProtect
+
+    return CSRFProtect()
+
+
+def _serves_http() -> bool:
+    """False for Flask CLI commands that never handle requests (db, rss:*, user:*)."""
+    if not os.environ.get("FLASK_RUN_FROM_CLI"):
+        return True
+    return any(arg in _HTTP_CLI_COMMANDS for arg in sys.argv[1:])
+
+
+def _init_redis_sessions(app: Flask) -> None:
+    """Keep session data in Redis (Flask-Session); the cookie then holds only a session id."""
+    url = app.config.get("SESSION_REDIS_URL")
+    if not url:
+        raise RuntimeError("SESSION_BACKEND=redis requires SESSION_REDIS_URL or REDIS_URL")
+    import redis
+    from flask_session import Session
+
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis.Redis.from_url(url)
+    Session(app)
+
+
+def _init_http(app: Flask) -> None:
+    """Register request-serving extensions: CSRF, rate limiting and friendly error handlers."""
+    from flask_wtf.csrf import CSRFError
 
     # CSRF protection (global)
-    csrf = CSRFProtect()
+    csrf = _csrf()
     csrf.init_app(app)
 
     # Rate limiting (global)
     limiter.init_app(app)
 
+    # Server-side sessions (opt-in)
+    if app.config.get("SESSION_BACKEND") == "redis":
+        _init_redis_sessions(app)
+
+    # Background email sender (started here so the first login doesn't pay for it)
+    from .mail import start_worker as _start_mail_worker
+    _start_mail_worker()
+
     # Exempt Stripe webhook (validated by Stripe signature separately)
-    try:
-        from .billing.routes import stripe_webhook as _stripe_webhook
-        csrf.exempt(_stripe_webhook)
-    except Exception:
-        pass
+    if app.config.get("BILLING_ENABLED", True):
+        try:
+            from .billing.routes import stripe_webhook as _stripe_webhook
+            csrf.exempt(_stripe_webhook)
+        except Exception:
+            pass
 
     # Friendly CSRF error handler
     from flask import request, jsonify, render_template
@@ -175,35 +219,123 @@ def create_app() -> Flask:
         except Exception:
             return ("Something went wrong", 500)
 
+    # Compile the error templates now so the first error under load doesn't pay the Jinja parse
+    for template_name in _ERROR_TEMPLATES:
+        try:
+            app.jinja_env.get_template(template_name)
+        except Exception:
+            pass
+
+
+def create_app() -> Flask:
+    app = Flask(__name__, instance_relative_config=False)
+    app.config.from_object(Config())
+    # Increase max upload size to 50 MB for file-based generation
+    app.config.setdefault("MAX_CONTENT_LENGTH", 50 * 1024 * 1024)
+
+    # SQLite doesn't support the same pooling options as Postgres; avoid passing them.
+    try:
+        uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+        if isinstance(uri, str) and uri.startswith("sqlite"):
+            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+    except Exception:
+        pass
+
+    # Derive cookie security from APP_BASE_URL to avoid "secure cookie on http"
+    # which breaks login persistence (common cause of OAuth not logging in).
+    try:
+        base = app.config.get("APP_BASE_URL", "")
+        if isinstance(base, str):
+            # Normalize once so request paths can concatenate `APP_BASE_URL + path` directly
+            base = base.rstrip("/")
+            app.config["APP_BASE_URL"] = base
+        if isinstance(base, str) and base.startswith("https://"):
+            app.config["SESSION_COOKIE_SECURE"] = True
+        elif isinstance(base, str) and base.startswith("http://"):
+            app.config["SESSION_COOKIE_SECURE"] = False
+    except Exception:
+        pass
+
+    # Initialize Flask-SQLAlchemy
+    app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
+    db.init_app(app)
+    # Ensure models are imported so metadata is populated for Alembic autogenerate
+    from . import models as _models  # noqa: F401
+
+    # Alembic and the `flask db` group are only needed when invoked through the Flask CLI;
+    # web workers (gunicorn) skip the import and command registration entirely.
+    if _wants_alembic_cli():
+        _register_alembic_cli(app)
+
+    # Blueprints are imported here (not at module top) so importing the package stays cheap;
+    # optional features are skipped entirely (no import) when their config flag is off.
+    for module_name, flag in _BLUEPRINTS:
+        if flag and not app.config.get(flag, True):
+            continue
+        app.register_blueprint(importlib.import_module(module_name, __name__).bp)
+
+    # CSRF, rate limiting and HTTP error pages only matter when serving requests
+    if _serves_http():
+        _init_http(app)
+
     # Session last_seen tracker
     from flask import request
-    from .models import User, Session as UserSession
+    from .models import User
     from .db import db_session as _dbs
-    from datetime import datetime, timezone
+    from .utils import next_month, request_now
+
+    session_cookie_name = app.config.get("SESSION_COOKIE_NAME", "session")
 
     @app.before_request
     def _update_last_seen():
+        # Static assets, webhooks, preflights and cookieless (anonymous) requests never touch the DB
+        if request.endpoint in _LAST_SEEN_SKIP_ENDPOINTS or request.method in _LAST_SEEN_SKIP_METHODS:
+            return
+        if session_cookie_name not in request.cookies:
+            return
         from flask import session as _flask_session
         uid = _flask_session.get("user_id")
         if not uid:
             return
-        now = datetime.now(timezone.utc)
+        # Throttle: at most one last_seen write per user per process every few seconds
+        now_ts = time.monotonic()
+        with _LAST_SEEN_LOCK:
+            if now_ts - _LAST_SEEN_CACHE.get(uid, float("-inf")) < _LAST_SEEN_THROTTLE_S:
+                return
+            if len(_LAST_SEEN_CACHE) >= _LAST_SEEN_CACHE_MAX:
+                _LAST_SEEN_CACHE.clear()
+            _LAST_SEEN_CACHE[uid] = now_ts
+        now = request_now()
         with _dbs() as s:
-            user = s.get(User, uid)
-            if user:
-                user.last_seen_at = now
-                # Auto-renew monthly quotas if past renewal date
-                try:
-                    from .utils import next_month
-                    if user.plan_renews_at and now >= user.plan_renews_at:
+            # One UPDATE, no ORM hydration; RETURNING hands back what the renewal check needs
+            renews_at = s.execute(
+                update(User)
+                .where(User.id == uid)
+                .values(last_seen_at=now)
+                .returning(User.plan_renews_at)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            # Auto-renew monthly quotas if past renewal date (load the full row only when due)
+            try:
+                if renews_at and now >= renews_at:
+                    user = s.get(User, uid)
+                    if user:
                         user.quota_gpt_used = 0
                         user.quota_claude_used = 0
                         user.plan_renews_at = next_month(now)
-                except Exception:
-                    pass
+            except Exception:
+                pass
+
+    base_url = str(app.config.get("APP_BASE_URL") or "")
+
+    def _csrf_token() -> str:
+        # flask_wtf is imported on first use from a template, not at app construction
+        from flask_wtf.csrf import generate_csrf
+
+        return generate_csrf()
+
     @app.context_processor
     def inject_globals():
-        from flask_wtf.csrf import generate_csrf
         def user_display_name(user: object | None) -> str:
             try:
                 if not user:
@@ -214,22 +346,21 @@ def create_app() -> Flask:
                 # Prefer email local-part; split common separators, pick first token
                 email = getattr(user, "email", None) or ""
                 local = email.split("@")[0]
-                token = re.split(r"[._-]+", local)[0]
+                token = _LOCAL_PART_SPLIT.split(local, maxsplit=1)[0]
                 return token.capitalize() if token else "there"
             except Exception:
                 return "there"
         def absolute_url(path: str) -> str:
-            base = app.config.get("APP_BASE_URL", "").rstrip("/")
             if not path.startswith("/"):
                 path = "/" + path
-            return f"{base}{path}" if base else path
+            return f"{base_url}{path}" if base_url else path
         # Expose CSS helper for templates
         try:
             from .static.css.css import render_stylesheets as css
         except Exception:
             def css(*_args, **_kwargs):
                 return ""
-        return {"app_name": "LinkerHero", "version": "0.1.0", "user_display_name": user_display_name, "absolute_url": absolute_url, "css": css, "csrf_token": generate_csrf}
+        return {"app_name": "LinkerHero", "version": "0.1.0", "user_display_name": user_display_name, "absolute_url": absolute_url, "css": css, "csrf_token": _csrf_token}
 
     @app.cli.command("db:ping")
     def db_ping() -> None:
@@ -237,14 +368,13 @@ def create_app() -> Flask:
         session.execute(text("SELECT 1"))
         print("ok")
 
-    from .news.rss import refresh_all_feeds, refresh_category_feeds
-    from .news.rss import repair_article_categories_from_source
-    from .news.services import CategoryService
-
     @app.cli.command("rss:refresh")
     @click.option("--category", "-c", default=None, help="Category slug to refresh (or all if not specified)")
     def rss_refresh(category: str | None) -> None:
         """Refresh RSS feeds and ingest new articles."""
+        from .news.rss import refresh_all_feeds, refresh_category_feeds
+        from .news.services import CategoryService
+
         # Ensure all categories exist in DB first
         CategoryService.ensure_categories_exist()
         
@@ -258,15 +388,11 @@ def create_app() -> Flask:
     @app.cli.command("rss:purge_no_image")
     def rss_purge_no_image() -> None:
         from .models import Article
-        from sqlalchemy import select
-        removed = 0
-        with db.session.begin():
-            rows = db.session.execute(
-                select(Article).where(Article.deleted_at.is_(None)).where(Article.image_url.is_(None))
-            ).scalars().all()
-            for a in rows:
-                a.deleted_at = datetime.now(timezone.utc)
-                removed += 1
+        removed = bulk_update_where(
+            Article,
+            (Article.deleted_at.is_(None), Article.image_url.is_(None)),
+            {"deleted_at": request_now()},
+        )
         print(f"soft-deleted {removed} articles without image")
 
     @app.cli.command("rss:repair_categories")
@@ -278,18 +404,20 @@ def create_app() -> Flask:
         Use this if categories were renamed/reconfigured historically and Content Fuel filters
         show articles from the wrong category.
         """
+        from .news.rss import repair_article_categories_from_source
+        from .news.services import CategoryService
+
         CategoryService.ensure_categories_exist()
         res = repair_article_categories_from_source(dry_run=dry_run)
         print(f"repaired={res['repaired']} skipped_unknown_source={res['skipped_unknown_source']}")
 
-    from .auth.services import ensure_admin
-    import click
-
     @app.cli.command("user:create_admin")
     @click.argument("email")
     def create_admin_cmd(email: str) -> None:
-        ensure_admin(email)
-        print("admin ensured")
+        from .auth.services import ensure_admin
+
+        user_id = ensure_admin(email)
+        print(f"admin ensured (id={user_id})")
 
     return app
 
@@ -1,9 +1,18 @@
 from __future__ import annotations
 
-from flask import Blueprint
+from flask import Blueprint, g, request
 
 bp = Blueprint("auth", __name__, url_prefix="")
 
+
+@bp.before_request
+def _capture_client() -> None:
+    # Login handlers record these on the session row; X-Forwarded-For lists the client first
+    xff = request.headers.get("X-Forwarded-For")
+    g.client_ip = xff.split(",", 1)[0].strip() if xff else request.remote_addr
+    g.user_agent = request.headers.get("User-Agent")
+
+
 # Import route modules to register handlers with the blueprint
 from . import basic  # noqa: F401,E402
 from . import oauth_google  # noqa: F401,E402
@@ -1,10 +1,8 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
-
 from flask import (
-    current_app,
     flash,
+    g,
     redirect,
     render_template,
     request,
@@ -13,27 +11,43 @@ from flask import (
 )
 from flask_limiter.util import get_remote_address
 from itsdangerous import BadSignature, SignatureExpired
-from sqlalchemy import select
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import bindparam, select, update
 
-from ...db import db_session
+from ...db import db_session, dialect_insert
 from ...limiter import limiter
-from ...models import Session as UserSession, User
-from ...utils import next_month
+from ...models import User
+from ...utils import next_month, request_now
+from ..session_recorder import record_session
 from ..services import (
+    absolute_url_for,
     confirm_serializer,
-    magic_serializer,
+    default_display_name,
+    forget_user_email,
+    hash_password,
+    link_email_html,
+    load_magic_token,
+    load_user_by_email,
+    make_magic_token,
+    normalize_email,
+    password_needs_rehash,
     register_form,
     send_email,
+    verify_password,
 )
 from . import bp
 
+# Built once so each request only binds `email` against the already-cached compiled statement
+_SEL_VERIFIED_AT_BY_EMAIL = select(User.email_verified_at).where(User.email == bindparam("email"))
+_SEL_LOGIN_BY_EMAIL = select(User.id, User.password_hash, User.email_verified_at).where(
+    User.email == bindparam("email")
+)
+
 
 @bp.route("/register", methods=["GET", "POST"])
 @limiter.limit("3 per minute", key_func=get_remote_address, methods=["POST"])
 @limiter.limit(
     "10 per hour",
-    key_func=lambda: (request.form.get("email", "").strip().lower() or get_remote_address()),
+    key_func=lambda: (normalize_email(request.form.get("email")) or get_remote_address()),
     methods=["POST"],
 )
 def register():
@@ -43,14 +57,12 @@ def register():
         return render_template("auth_register_spaceship.html", prefill_email=pre, already_registered=already)
 
     form = register_form(request.form)
-    if not (
-        getattr(form, "validate_on_submit", None)
-        and form.validate_on_submit()
-    ) and not (hasattr(form, "validate") and form.validate()):
+    # Both the WTForms form and the minimal fallback validate exactly once here
+    if not form.validate():
         flash("Please correct the highlighted fields and try again.", "error")
         return redirect(url_for("auth.register", email=request.form.get("email", "").strip()))
 
-    email = form.email.data.strip().lower()
+    email = normalize_email(form.email.data)
     pwd = form.password.data
     cpw = getattr(form, "confirm_password", None)
     if cpw and getattr(cpw, "data", None) != pwd:
@@ -63,46 +75,43 @@ def register():
         flash("You must agree to the Privacy Policy.", "error")
         return redirect(url_for("auth.register", email=email))
 
+    now = request_now()
+    users = User.__table__
+    # Insert-if-absent in one statement; RETURNING is empty when the email is already registered
+    stmt = (
+        dialect_insert(users)
+        .values(
+            email=email,
+            display_name=default_display_name(email),
+            password_hash=hash_password(pwd),
+            plan="free",
+            plan_started_at=now,
+            plan_renews_at=next_month(now),
+            marketing_opt_in=marketing_opt_in,
+            privacy_accepted_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=["email"])
+        .returning(users.c.id)
+    )
+    forget_user_email(email)
     with db_session() as session_db:
-        existing = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        if existing:
-            if not getattr(existing, "email_verified_at", None):
+        created_id = session_db.execute(stmt).scalar()
+        if created_id is None:
+            verified_at = session_db.execute(_SEL_VERIFIED_AT_BY_EMAIL, {"email": email}).scalar()
+            if not verified_at:
                 token = confirm_serializer().dumps(email)
-                link = f"{current_app.config['APP_BASE_URL']}{url_for('auth.confirm')}?token={token}"
+                link = f"{absolute_url_for('auth.confirm')}?token={token}"
                 text_body = f"Please confirm your email: {link}"
-                html_body = render_template(
-                    "emails/confirm_email.html",
-                    confirm_link=link,
-                    app_name="LinkerHero",
-                    app_base_url=current_app.config.get("APP_BASE_URL", ""),
-                )
+                html_body = link_email_html("emails/confirm_email.html", "confirm_link", link)
                 send_email(email, "Confirm your LinkerHero email", text_body, html_body=html_body)
                 flash("This email is already registered. We re-sent the confirmation link.", "success")
                 return redirect(url_for("auth.register", email=email))
             return redirect(url_for("auth.register", email=email, already=1))
 
-        now = datetime.now(timezone.utc)
-        user = User(
-            email=email,
-            display_name=(email.split("@")[0].split(".")[0].split("_")[0].capitalize() if email else None),
-            password_hash=generate_password_hash(pwd),
-            plan="free",
-            plan_started_at=now,
-            plan_renews_at=next_month(now),
-            marketing_opt_in=marketing_opt_in,
-            privacy_accepted_at=datetime.now(timezone.utc),
-        )
-        session_db.add(user)
-        session_db.flush()
         token = confirm_serializer().dumps(email)
-        link = f"{current_app.config['APP_BASE_URL']}{url_for('auth.confirm')}?token={token}"
+        link = f"{absolute_url_for('auth.confirm')}?token={token}"
         text_body = f"Please confirm your email: {link}"
-        html_body = render_template(
-            "emails/confirm_email.html",
-            confirm_link=link,
-            app_name="LinkerHero",
-            app_base_url=current_app.config.get("APP_BASE_URL", ""),
-        )
+        html_body = link_email_html("emails/confirm_email.html", "confirm_link", link)
         send_email(email, "Confirm your LinkerHero email", text_body, html_body=html_body)
         flash("Confirmation email sent. Please check your inbox.", "success")
     return redirect(url_for("auth.register", email=email))
@@ -112,7 +121,7 @@ def register():
 @limiter.limit("3 per minute", key_func=get_remote_address, methods=["POST"])
 @limiter.limit(
     "10 per hour",
-    key_func=lambda: (request.form.get("email", "").strip().lower() or get_remote_address()),
+    key_func=lambda: (normalize_email(request.form.get("email")) or get_remote_address()),
     methods=["POST"],
 )
 def login():
@@ -120,17 +129,17 @@ def login():
         pre = request.args.get("email", "").strip()
         next_param = request.args.get("next", "").strip()
         return render_template("auth_login_spaceship.html", sent=False, prefill_email=pre, next_param=next_param)
-    email = request.form.get("email", "").strip().lower()
+    email = normalize_email(request.form.get("email"))
     if not email:
         flash("Email required", "error")
         return redirect(url_for("auth.login"))
     with db_session() as session_db:
-        existing = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        if existing and not existing.email_verified_at:
+        existing = session_db.execute(_SEL_VERIFIED_AT_BY_EMAIL, {"email": email}).first()
+        if existing is not None and not existing.email_verified_at:
             return redirect(url_for("auth.resend_confirm", email=email))
-    token = magic_serializer().dumps(email)
+    token = make_magic_token(email)
     next_url = request.args.get("next") or request.form.get("next") or url_for("main.index")
-    link = f"{current_app.config['APP_BASE_URL']}{url_for('auth.magic')}?token={token}&next={next_url}"
+    link = f"{absolute_url_for('auth.magic')}?token={token}&next={next_url}"
     send_email(email, "Your LinkerHero login", f"Click to sign in: {link}")
     flash("Magic sign-in link sent. Check your inbox.", "success")
     return redirect(url_for("auth.login", email=email))
@@ -142,54 +151,52 @@ def magic():
     next_url = request.args.get("next") or url_for("main.index")
     if not token:
         return redirect(url_for("main.index"))
-    try:
-        email = magic_serializer().loads(token, max_age=3600)
-    except (BadSignature, SignatureExpired):
+    email = load_magic_token(token)
+    if not email:
         return redirect(url_for("auth.login"))
 
+    now = request_now()
+    users = User.__table__
+    # Find-or-create in one round-trip; the no-op update makes RETURNING yield existing rows too
+    stmt = (
+        dialect_insert(users)
+        .values(
+            email=email,
+            display_name=default_display_name(email),
+            plan_started_at=now,
+            plan_renews_at=next_month(now),
+        )
+        .on_conflict_do_update(index_elements=["email"], set_={"email": email})
+        .returning(users.c.id, users.c.email_verified_at)
+    )
     with db_session() as session_db:
-        user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        if user is None:
-            now = datetime.now(timezone.utc)
-            user = User(
-                email=email,
-                display_name=(email.split("@")[0].split(".")[0].split("_")[0].capitalize() if email else None),
-                plan_started_at=now,
-                plan_renews_at=next_month(now),
-            )
-            session_db.add(user)
-            session_db.flush()
+        user = session_db.execute(stmt).one()
         if not user.email_verified_at:
             return redirect(url_for("auth.resend_confirm", email=email))
         session["user_id"] = user.id
-        ua = request.headers.get("User-Agent")
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-        now = datetime.now(timezone.utc)
-        session_db.add(UserSession(user_id=user.id, user_agent=ua, ip_address=ip, created_at=now, last_seen_at=now))
+        ua = g.user_agent
+        ip = g.client_ip
+    record_session(session["user_id"], ua, ip, now)
     return redirect(next_url)
 
 
 @bp.route("/confirm/resend")
 @limiter.limit(
     "3 per hour",
-    key_func=lambda: (request.args.get("email", "").strip().lower() or get_remote_address()),
+    key_func=lambda: (normalize_email(request.args.get("email")) or get_remote_address()),
 )
 def resend_confirm():
-    email = request.args.get("email", "").strip().lower()
+    email = normalize_email(request.args.get("email"))
     if not email:
         return redirect(url_for("auth.login"))
     token = confirm_serializer().dumps(email)
-    link = f"{current_app.config['APP_BASE_URL']}{url_for('auth.confirm')}?token={token}"
+    link = f"{absolute_url_for('auth.confirm')}?token={token}"
     text_body = f"Please confirm your email: {link}"
-    html_body = render_template(
-        "emails/confirm_email.html",
-        confirm_link=link,
-        app_name="LinkerHero",
-        app_base_url=current_app.config.get("APP_BASE_URL", ""),
-    )
+    html_body = link_email_html("emails/confirm_email.html", "confirm_link", link)
     send_email(email, "Confirm your LinkerHero email", text_body, html_body=html_body)
     flash("Confirmation email sent. Please check your inbox.")
-    return render_template("auth_magic_spaceship.html")
+    # Post/redirect/get: reloading the result page doesn't send (and rate-limit) another email
+    return redirect(url_for("auth.login", email=email))
 
 
 @bp.route("/confirm")
@@ -201,9 +208,9 @@ def confirm():
         email = confirm_serializer().loads(token, max_age=3 * 24 * 3600)
     except (BadSignature, SignatureExpired):
         return redirect(url_for("auth.login"))
-    now = datetime.now(timezone.utc)
+    now = request_now()
     with db_session() as session_db:
-        user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
+        user = load_user_by_email(session_db, email)
         if user is None:
             return redirect(url_for("auth.login"))
         if not user.email_verified_at:
@@ -222,27 +229,32 @@ def logout():
 @limiter.limit("5 per minute", key_func=get_remote_address, methods=["POST"])
 @limiter.limit(
     "20 per hour",
-    key_func=lambda: (request.form.get("email", "").strip().lower() or get_remote_address()),
+    key_func=lambda: (normalize_email(request.form.get("email")) or get_remote_address()),
     methods=["POST"],
 )
 def login_password():
-    email = request.form.get("email", "").strip().lower()
+    email = normalize_email(request.form.get("email"))
     password = request.form.get("password", "")
     if not email or not password:
         flash("Email and password required", "error")
         return redirect(url_for("auth.login", email=email))
     with db_session() as session_db:
-        user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        if user is None or not user.password_hash or not check_password_hash(user.password_hash, password):
+        user = session_db.execute(_SEL_LOGIN_BY_EMAIL, {"email": email}).first()
+        if not verify_password(user.password_hash if user is not None else None, password):
             flash("Invalid credentials", "error")
             return redirect(url_for("auth.login", email=email))
+        if password_needs_rehash(user.password_hash):
+            # Upgrade hashes from an older method/cost while the plaintext is at hand
+            session_db.execute(
+                update(User).where(User.id == user.id).values(password_hash=hash_password(password))
+            )
         if not user.email_verified_at:
             return redirect(url_for("auth.resend_confirm", email=email))
         session["user_id"] = user.id
-        ua = request.headers.get("User-Agent")
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-        now = datetime.now(timezone.utc)
-        session_db.add(UserSession(user_id=user.id, user_agent=ua, ip_address=ip, created_at=now, last_seen_at=now))
+        ua = g.user_agent
+        ip = g.client_ip
+        now = request_now()
+    record_session(session["user_id"], ua, ip, now)
     next_url = request.form.get("next") or url_for("main.index")
     return redirect(next_url)
 
@@ -1,23 +1,58 @@
 from __future__ import annotations
 
+import base64
+import hmac
+import json
 import os
 import secrets
-from datetime import datetime, timezone
-from urllib.parse import quote_plus, urlencode, urlparse
+import time
+from typing import Any
+from urllib.parse import urlparse
 
-import httpx
-from flask import current_app, flash, redirect, request, session, url_for
+from flask import current_app, flash, g, redirect, request, session, url_for
 from flask_limiter.util import get_remote_address
-from sqlalchemy import select
 
 from ...db import db_session
+from ...http_client import http_client
 from ...limiter import limiter
-from ...models import Session as UserSession, User
-from ...utils import next_month
-from ..services import absolute_url_for
+from ...models import User, generate_uuid
+from ...utils import next_month, request_now
+from ..session_recorder import record_session
+from ..services import (
+    absolute_url_for,
+    default_display_name,
+    find_oauth_user,
+    normalize_email,
+    oauth_authorize_prefix,
+    upsert_oauth_user,
+)
 from . import bp
 
 
+_GOOGLE_USERINFO_URL = "https://openidconnect.googleapis.com/v1/userinfo"
+_GOOGLE_ISSUERS = {"https://accounts.google.com", "accounts.google.com"}
+
+
+def _id_token_claims(id_token: str | None, client_id: str) -> dict[str, Any] | None:
+    """Claims of an id_token received directly from Google's token endpoint, or None.
+
+    Per OIDC Core 3.1.3.7 the TLS connection to the token endpoint already authenticates Google,
+    so the JWT signature isn't re-verified; issuer, audience and expiry still are.
+    """
+    if not id_token:
+        return None
+    try:
+        payload = id_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if claims.get("iss") not in _GOOGLE_ISSUERS or claims.get("aud") != client_id:
+            return None
+        if float(claims.get("exp") or 0) < time.time():
+            return None
+    except Exception:
+        return None
+    return claims
+
+
 @bp.route("/oauth/google/start")
 @limiter.limit("10 per minute", key_func=get_remote_address)
 def login_google_start():
@@ -40,32 +75,30 @@ def login_google_start():
                 return redirect(target)
     except Exception:
         pass
-    redirect_uri = absolute_url_for("auth.login_google_callback")
     scopes = current_app.config.get("GOOGLE_SCOPES") or os.getenv("GOOGLE_SCOPES") or "openid email profile"
     state = secrets.token_urlsafe(16)
     session["gg_oauth_state"] = state
     # Default to dashboard so the user clearly sees they're logged in.
     next_url = request.args.get("next") or request.args.get("return_to") or url_for("main.dashboard")
     session["gg_oauth_next"] = next_url
-    params = {
-        "response_type": "code",
-        "client_id": client_id,
-        "redirect_uri": redirect_uri,
-        "scope": scopes,
-        "state": state,
-        "access_type": "offline",
-        "include_granted_scopes": "true",
-        "prompt": "consent",
-    }
-    auth_url = "https://accounts.google.com/o/oauth2/v2/auth?" + urlencode(params, quote_via=quote_plus)
-    return redirect(auth_url)
+    prefix = oauth_authorize_prefix(
+        "https://accounts.google.com/o/oauth2/v2/auth",
+        "auth.login_google_callback",
+        client_id,
+        scopes,
+        access_type="offline",
+        include_granted_scopes="true",
+        prompt="consent",
+    )
+    return redirect(f"{prefix}&state={state}")
 
 
 @bp.route("/auth/google/callback")
 def login_google_callback():
     code = request.args.get("code")
     state = request.args.get("state")
-    if not state or state != session.get("gg_oauth_state"):
+    expected_state = session.get("gg_oauth_state") or ""
+    if not state or not hmac.compare_digest(state.encode(), expected_state.encode()):
         flash(
             "Google sign-in failed (session was lost). Check cookies, and ensure APP_BASE_URL matches your current domain (www vs non-www, http vs https).",
             "error",
@@ -83,7 +116,7 @@ def login_google_callback():
 
     token_url = "https://oauth2.googleapis.com/token"
     try:
-        resp = httpx.post(
+        resp = http_client().post(
             token_url,
             data={
                 "grant_type": "authorization_code",
@@ -92,7 +125,6 @@ def login_google_callback():
                 "client_id": client_id,
                 "client_secret": client_secret,
             },
-            timeout=20.0,
         )
         resp.raise_for_status()
         token_data = resp.json()
@@ -112,9 +144,12 @@ def login_google_callback():
     full_name = None
     picture = None
     try:
-        prof = httpx.get("https://openidconnect.googleapis.com/v1/userinfo", headers=headers, timeout=20.0).json()
+        # The id_token already carries the profile claims; userinfo is only a fallback
+        prof = _id_token_claims(token_data.get("id_token"), client_id)
+        if not prof or not prof.get("email"):
+            prof = http_client().get(_GOOGLE_USERINFO_URL, headers=headers).json()
         sub = prof.get("sub")
-        email = (prof.get("email") or "").lower().strip()
+        email = normalize_email(prof.get("email"))
         given_name = prof.get("given_name")
         full_name = prof.get("name")
         picture = prof.get("picture")
@@ -126,59 +161,64 @@ def login_google_callback():
         return redirect(url_for("auth.login"))
 
     with db_session() as session_db:
-        user = None
-        # Prefer stable OAuth identity lookup first
-        if sub:
-            user = session_db.execute(
-                select(User).where(User.oauth_provider == "google", User.oauth_sub == sub)
-            ).scalar_one_or_none()
-        # Optionally link by email (default behavior)
-        if user is None and email and current_app.config.get("OAUTH_LINK_BY_EMAIL", True):
-            user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        # If we are NOT linking by email and an account already exists for that email, refuse OAuth login.
-        if user is None and email and not current_app.config.get("OAUTH_LINK_BY_EMAIL", True):
-            existing_by_email = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-            if existing_by_email is not None:
+        # Stable OAuth identity first; the email's current owner comes back from the same query
+        user, existing_id = find_oauth_user(session_db, provider="google", sub=sub, email=email)
+        now = request_now()
+        link_by_email = current_app.config.get("OAUTH_LINK_BY_EMAIL", True)
+        if user is None and email and link_by_email:
+            # Link by email (default behavior): find-or-create and fill the profile in one round-trip
+            session["user_id"] = upsert_oauth_user(
+                session_db,
+                provider="google",
+                sub=sub,
+                email=email,
+                display_name=given_name or default_display_name(email),
+                given_name=given_name,
+                full_name=full_name or None,
+                picture=picture or None,
+                now=now,
+            )
+        else:
+            # If we are NOT linking by email and an account already exists for that email, refuse OAuth login.
+            if user is None and existing_id is not None:
                 flash(
                     "An account already exists for this email. Please sign in using the original method "
                     "(email/password or the provider you used before), or use a different Google account/email.",
                     "error",
                 )
                 return redirect(url_for("auth.login", email=email))
-        if user is None:
-            now = datetime.now(timezone.utc)
-            user = User(
-                email=email or f"gg_{sub}@example.local",
-                display_name=given_name
-                or (email.split("@")[0].split(".")[0].split("_")[0].capitalize() if email else None),
-                full_name=full_name or None,
-                profile_image_url=picture or None,
-                profile_source="google",
-                oauth_provider="google",
-                oauth_sub=sub,
-                plan="free",
-                plan_started_at=now,
-                plan_renews_at=next_month(now),
-                email_verified_at=now,
-            )
-            session_db.add(user)
-            session_db.flush()
-        else:
-            if given_name and (not getattr(user, "display_name", None)):
-                user.display_name = given_name
-            if full_name and (not getattr(user, "full_name", None)):
-                user.full_name = full_name
-            if picture and (not getattr(user, "profile_image_url", None)):
-                user.profile_image_url = picture
-            if not getattr(user, "profile_source", None):
-                user.profile_source = "google"
-            if email and not user.email_verified_at:
-                user.email_verified_at = datetime.now(timezone.utc)
-        session["user_id"] = user.id
-        ua = request.headers.get("User-Agent")
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-        now = datetime.now(timezone.utc)
-        session_db.add(UserSession(user_id=user.id, user_agent=ua, ip_address=ip, created_at=now, last_seen_at=now))
+            if user is None:
+                user = User(
+                    id=generate_uuid(),
+                    email=email or f"gg_{sub}@example.local",
+                    display_name=given_name or default_display_name(email),
+                    full_name=full_name or None,
+                    profile_image_url=picture or None,
+                    profile_source="google",
+                    oauth_provider="google",
+                    oauth_sub=sub,
+                    plan="free",
+                    plan_started_at=now,
+                    plan_renews_at=next_month(now),
+                    email_verified_at=now,
+                )
+                # id is assigned up front, so the INSERT can wait for the commit instead of a flush
+                session_db.add(user)
+            else:
+                if given_name and (not getattr(user, "display_name", None)):
+                    user.display_name = given_name
+                if full_name and (not getattr(user, "full_name", None)):
+                    user.full_name = full_name
+                if picture and (not getattr(user, "profile_image_url", None)):
+                    user.profile_image_url = picture
+                if not getattr(user, "profile_source", None):
+                    user.profile_source = "google"
+                if email and not user.email_verified_at:
+                    user.email_verified_at = now
+            session["user_id"] = user.id
+        ua = g.user_agent
+        ip = g.client_ip
+    record_session(session["user_id"], ua, ip, now)
     next_url = session.pop("gg_oauth_next", None) or url_for("main.index")
     return redirect(next_url)
 
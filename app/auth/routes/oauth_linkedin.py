@@ -1,22 +1,61 @@
 from __future__ import annotations
 
+import hmac
 import json
 import secrets
-from datetime import datetime, timezone
-from urllib.parse import quote_plus, urlencode
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
 
-import httpx
-from flask import current_app, flash, redirect, request, session, url_for
+from flask import current_app, flash, g, redirect, request, session, url_for
 from flask_limiter.util import get_remote_address
+from itsdangerous import BadSignature, SignatureExpired
 from sqlalchemy import select
 
 from ...db import db_session
+from ...http_client import http_client
 from ...limiter import limiter
-from ...models import Generation, Session as UserSession, User
-from ...utils import next_month
-from ..services import absolute_url_for
+from ...models import Generation, User, generate_uuid
+from ...utils import next_month, request_now
+from ..session_recorder import record_session
+from ..services import (
+    absolute_url_for,
+    default_display_name,
+    find_oauth_user,
+    normalize_email,
+    oauth_authorize_prefix,
+    share_serializer,
+    upsert_oauth_user,
+)
 from . import bp
 
+try:
+    import orjson
+
+    _dump_json = orjson.dumps
+except ImportError:  # orjson is an optional speedup; this fallback emits the same compact UTF-8
+
+    def _dump_json(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+_LI_AUTHORIZE_URL = "https://www.linkedin.com/oauth/v2/authorization"
+_LI_EMAIL_URL = "https://api.linkedin.com/v2/emailAddress?q=members&projection=(elements*(handle~))"
+# LinkedIn's commentary limit is 3000 characters; drafts are cut a little short of it
+_SHARE_TEXT_MAX_CHARS = 2800
+# How long the ownership check made by share_linkedin_start stays valid for the callback
+_SHARE_GRANT_MAX_AGE_S = 900
+# Runs the legacy emailAddress lookup alongside /v2/userinfo so the fallback costs no extra round-trip
+_email_lookups = ThreadPoolExecutor(max_workers=4, thread_name_prefix="linkedin-email")
+
+
+def _fetch_linkedin_email(headers: dict[str, str]) -> str:
+    try:
+        email_resp = http_client().get(_LI_EMAIL_URL, headers=headers).json()
+        handle = (email_resp.get("elements") or [{}])[0].get("handle~", {})
+        return normalize_email(handle.get("emailAddress"))
+    except Exception:
+        return ""
+
 
 @bp.route("/login/linkedin")
 @limiter.limit("10 per minute", key_func=get_remote_address)
@@ -24,22 +63,14 @@ def login_linkedin_start():
     client_id = current_app.config.get("LINKEDIN_CLIENT_ID")
     if not client_id:
         return redirect(url_for("auth.login"))
-    redirect_uri = absolute_url_for("auth.login_linkedin_callback")
     scopes = current_app.config.get("LINKEDIN_SCOPES", "openid profile email")
     state = secrets.token_urlsafe(16)
     session["li_oauth_state"] = state
     # Default to dashboard so the user clearly sees they're logged in.
     next_url = request.args.get("next") or request.args.get("return_to") or url_for("main.dashboard")
     session["li_oauth_next"] = next_url
-    params = {
-        "response_type": "code",
-        "client_id": client_id,
-        "redirect_uri": redirect_uri,
-        "scope": scopes,
-        "state": state,
-    }
-    auth_url = "https://www.linkedin.com/oauth/v2/authorization?" + urlencode(params, quote_via=quote_plus)
-    return redirect(auth_url)
+    prefix = oauth_authorize_prefix(_LI_AUTHORIZE_URL, "auth.login_linkedin_callback", client_id, scopes)
+    return redirect(f"{prefix}&state={state}")
 
 
 @bp.route("/share/linkedin/start")
@@ -60,23 +91,17 @@ def share_linkedin_start():
     if not client_id:
         return redirect(url_for("auth.login"))
     session["li_share_gen_id"] = gen_id
+    # Records the ownership check above, so the callback only has to read the draft text
+    session["li_share_grant"] = share_serializer().dumps({"gid": gen_id, "uid": uid})
     session["li_oauth_flow"] = "share"
     session["li_oauth_next"] = request.referrer or url_for("main.dashboard")
-    redirect_uri = absolute_url_for("auth.login_linkedin_callback")
     scopes = current_app.config.get("LINKEDIN_SCOPES", "openid profile email")
     if "w_member_social" not in scopes:
         scopes = scopes + " w_member_social"
     state = secrets.token_urlsafe(16)
     session["li_oauth_state"] = state
-    params = {
-        "response_type": "code",
-        "client_id": client_id,
-        "redirect_uri": redirect_uri,
-        "scope": scopes,
-        "state": state,
-    }
-    auth_url = "https://www.linkedin.com/oauth/v2/authorization?" + urlencode(params, quote_via=quote_plus)
-    return redirect(auth_url)
+    prefix = oauth_authorize_prefix(_LI_AUTHORIZE_URL, "auth.login_linkedin_callback", client_id, scopes)
+    return redirect(f"{prefix}&state={state}")
 
 
 @bp.route("/oauth/linkedin/start")
@@ -88,7 +113,8 @@ def login_linkedin_start_alias():
 def login_linkedin_callback():
     code = request.args.get("code")
     state = request.args.get("state")
-    if not state or state != session.get("li_oauth_state"):
+    expected_state = session.get("li_oauth_state") or ""
+    if not state or not hmac.compare_digest(state.encode(), expected_state.encode()):
         flash(
             "LinkedIn sign-in failed (session was lost). Check cookies, and ensure APP_BASE_URL matches your current domain (www vs non-www, http vs https).",
             "error",
@@ -107,7 +133,7 @@ def login_linkedin_callback():
 
     token_url = "https://www.linkedin.com/oauth/v2/accessToken"
     try:
-        resp = httpx.post(
+        resp = http_client().post(
             token_url,
             data={
                 "grant_type": "authorization_code",
@@ -116,7 +142,6 @@ def login_linkedin_callback():
                 "client_id": client_id,
                 "client_secret": client_secret,
             },
-            timeout=20.0,
         )
         resp.raise_for_status()
         token_data = resp.json()
@@ -134,10 +159,11 @@ def login_linkedin_callback():
     email = ""
     full_name = None
     picture = None
+    email_lookup = _email_lookups.submit(_fetch_linkedin_email, headers)
     try:
-        prof = httpx.get("https://api.linkedin.com/v2/userinfo", headers=headers, timeout=20.0).json()
+        prof = http_client().get("https://api.linkedin.com/v2/userinfo", headers=headers).json()
         sub = prof.get("sub")
-        email = (prof.get("email") or "").lower().strip()
+        email = normalize_email(prof.get("email"))
         try:
             full_name = (prof.get("name") or None) if isinstance(prof, dict) else None
         except Exception:
@@ -148,22 +174,10 @@ def login_linkedin_callback():
             picture = None
     except Exception:
         prof = {}
-    if not email:
-        try:
-            email_resp = httpx.get(
-                "https://api.linkedin.com/v2/emailAddress?q=members&projection=(elements*(handle~))",
-                headers=headers,
-                timeout=20.0,
-            ).json()
-            email = (
-                (email_resp.get("elements") or [{}])[0]
-                .get("handle~", {})
-                .get("emailAddress", "")
-                .lower()
-                .strip()
-            )
-        except Exception:
-            email = ""
+    if email:
+        email_lookup.cancel()
+    else:
+        email = email_lookup.result()
 
     if not (email or sub):
         flash("LinkedIn sign-in failed (no email returned by LinkedIn).", "error")
@@ -173,6 +187,7 @@ def login_linkedin_callback():
     is_share_flow = bool(session.get("li_share_gen_id")) or (session.get("li_oauth_flow") == "share")
     if is_share_flow:
         pending_gen_id = session.pop("li_share_gen_id", None)
+        share_grant = session.pop("li_share_grant", None)
         session.pop("li_oauth_flow", None)
         if not pending_gen_id:
             flash("LinkedIn share failed (missing draft). Please try again.", "error")
@@ -193,106 +208,116 @@ def login_linkedin_callback():
                 "X-Restli-Protocol-Version": "2.0.0",
                 "Content-Type": "application/json",
             }
+            try:
+                grant = share_serializer().loads(share_grant or "", max_age=_SHARE_GRANT_MAX_AGE_S)
+            except (BadSignature, SignatureExpired):
+                grant = None
             with db_session() as session_db:
-                gen = session_db.get(Generation, pending_gen_id)
-                if not gen or gen.user_id != app_uid:
-                    flash(
-                        "LinkedIn share failed (draft not found for this account). Please open the draft again and retry.",
-                        "error",
-                    )
+                if grant == {"gid": pending_gen_id, "uid": app_uid}:
+                    draft_text = session_db.execute(
+                        select(Generation.draft_text).where(Generation.id == pending_gen_id)
+                    ).scalar()
                 else:
-                    payload = {
-                        "author": f"urn:li:person:{sub}",
-                        "lifecycleState": "PUBLISHED",
-                        "specificContent": {
-                            "com.linkedin.ugc.ShareContent": {
-                                "shareCommentary": {"text": gen.draft_text[:2800]},
-                                "shareMediaCategory": "NONE",
-                            }
-                        },
-                        "visibility": {
-                            "com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"
-                        },
-                    }
-                    resp = httpx.post(
-                        "https://api.linkedin.com/v2/ugcPosts",
-                        headers=ugc_headers,
-                        content=json.dumps(payload),
-                        timeout=20.0,
-                    )
-                    if resp.status_code == 201:
-                        flash("Shared on LinkedIn successfully.", "success")
-                    else:
-                        # Include some detail so debugging is possible (but keep it short)
-                        flash(f"LinkedIn share failed ({resp.status_code}). Please try again.", "error")
+                    gen = session_db.get(Generation, pending_gen_id)
+                    draft_text = gen.draft_text if gen and gen.user_id == app_uid else None
+            share_text = draft_text[:_SHARE_TEXT_MAX_CHARS] if draft_text is not None else None
+            if share_text is None:
+                flash(
+                    "LinkedIn share failed (draft not found for this account). Please open the draft again and retry.",
+                    "error",
+                )
+            else:
+                payload = {
+                    "author": f"urn:li:person:{sub}",
+                    "lifecycleState": "PUBLISHED",
+                    "specificContent": {
+                        "com.linkedin.ugc.ShareContent": {
+                            "shareCommentary": {"text": share_text},
+                            "shareMediaCategory": "NONE",
+                        }
+                    },
+                    "visibility": {
+                        "com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"
+                    },
+                }
+                resp = http_client().post(
+                    "https://api.linkedin.com/v2/ugcPosts",
+                    headers=ugc_headers,
+                    content=_dump_json(payload),
+                )
+                if resp.status_code == 201:
+                    flash("Shared on LinkedIn successfully.", "success")
+                else:
+                    # Include some detail so debugging is possible (but keep it short)
+                    flash(f"LinkedIn share failed ({resp.status_code}). Please try again.", "error")
         except Exception:
             flash("LinkedIn share failed. Please try again.", "error")
         next_url = session.pop("li_oauth_next", None) or url_for("main.dashboard")
         return redirect(next_url)
 
     with db_session() as session_db:
-        user = None
-        # Prefer stable OAuth identity lookup first
-        if sub:
-            user = session_db.execute(
-                select(User).where(User.oauth_provider == "linkedin", User.oauth_sub == sub)
-            ).scalar_one_or_none()
-        # Optionally link by email (default behavior)
-        if user is None and email and current_app.config.get("OAUTH_LINK_BY_EMAIL", True):
-            user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        # If we are NOT linking by email and an account already exists for that email, refuse OAuth login.
-        if user is None and email and not current_app.config.get("OAUTH_LINK_BY_EMAIL", True):
-            existing_by_email = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-            if existing_by_email is not None:
+        # Stable OAuth identity first; the email's current owner comes back from the same query
+        user, existing_id = find_oauth_user(session_db, provider="linkedin", sub=sub, email=email)
+        now = request_now()
+        try:
+            given_name = (prof.get("given_name") or None) if isinstance(prof, dict) else None
+        except Exception:
+            given_name = None
+        link_by_email = current_app.config.get("OAUTH_LINK_BY_EMAIL", True)
+        if user is None and email and link_by_email:
+            # Link by email (default behavior): find-or-create and fill the profile in one round-trip
+            session["user_id"] = upsert_oauth_user(
+                session_db,
+                provider="linkedin",
+                sub=sub,
+                email=email,
+                display_name=given_name or default_display_name(email),
+                given_name=given_name,
+                full_name=full_name or None,
+                picture=picture or None,
+                now=now,
+            )
+        else:
+            # If we are NOT linking by email and an account already exists for that email, refuse OAuth login.
+            if user is None and existing_id is not None:
                 flash(
                     "An account already exists for this email. Please sign in using the original method "
                     "(email/password or the provider you used before), or use a different LinkedIn account/email.",
                     "error",
                 )
                 return redirect(url_for("auth.login", email=email))
-        if user is None:
-            given_name = None
-            try:
-                given_name = (prof.get("given_name") or None) if isinstance(prof, dict) else None
-            except Exception:
-                given_name = None
-            now = datetime.now(timezone.utc)
-            user = User(
-                email=email or f"li_{sub}@example.local",
-                display_name=given_name
-                or (email.split("@")[0].split(".")[0].split("_")[0].capitalize() if email else None),
-                full_name=full_name or None,
-                profile_image_url=picture or None,
-                profile_source="linkedin",
-                oauth_provider="linkedin",
-                oauth_sub=sub,
-                plan="free",
-                plan_started_at=now,
-                plan_renews_at=next_month(now),
-            )
-            session_db.add(user)
-            session_db.flush()
-        else:
-            try:
-                given_name = (prof.get("given_name") or None) if isinstance(prof, dict) else None
-            except Exception:
-                given_name = None
-            if given_name and (not getattr(user, "display_name", None)):
-                user.display_name = given_name
-            if full_name and (not getattr(user, "full_name", None)):
-                user.full_name = full_name
-            if picture and (not getattr(user, "profile_image_url", None)):
-                user.profile_image_url = picture
-            if not getattr(user, "profile_source", None):
-                user.profile_source = "linkedin"
-        if email and not user.email_verified_at:
-            user.email_verified_at = datetime.now(timezone.utc)
-        session["user_id"] = user.id
-        ua = request.headers.get("User-Agent")
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-        now = datetime.now(timezone.utc)
-        session_db.add(UserSession(user_id=user.id, user_agent=ua, ip_address=ip, created_at=now, last_seen_at=now))
+            if user is None:
+                user = User(
+                    id=generate_uuid(),
+                    email=email or f"li_{sub}@example.local",
+                    display_name=given_name or default_display_name(email),
+                    full_name=full_name or None,
+                    profile_image_url=picture or None,
+                    profile_source="linkedin",
+                    oauth_provider="linkedin",
+                    oauth_sub=sub,
+                    plan="free",
+                    plan_started_at=now,
+                    plan_renews_at=next_month(now),
+                )
+                # id is assigned up front, so the INSERT can wait for the commit instead of a flush
+                session_db.add(user)
+            else:
+                if given_name and (not getattr(user, "display_name", None)):
+                    user.display_name = given_name
+                if full_name and (not getattr(user, "full_name", None)):
+                    user.full_name = full_name
+                if picture and (not getattr(user, "profile_image_url", None)):
+                    user.profile_image_url = picture
+                if not getattr(user, "profile_source", None):
+                    user.profile_source = "linkedin"
+            if email and not user.email_verified_at:
+                user.email_verified_at = now
+            session["user_id"] = user.id
+        ua = g.user_agent
+        ip = g.client_ip
 
+    record_session(session["user_id"], ua, ip, now)
     next_url = session.pop("li_oauth_next", None) or url_for("main.index")
     return redirect(next_url)
 
@@ -1,77 +1,263 @@
 from __future__ import annotations
 
-import smtplib
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 from email.message import EmailMessage
+from functools import lru_cache
 from typing import Any
+from urllib.parse import quote_plus, urlencode
 
-from flask import current_app, render_template, url_for
+from flask import current_app, g, has_request_context, render_template, url_for
 from itsdangerous import URLSafeTimedSerializer
-from sqlalchemy import select, update
+from markupsafe import escape
+from sqlalchemy import and_, bindparam, func, or_, select
+from werkzeug.security import check_password_hash, generate_password_hash
 
-from ..db import db_session
+from ..db import db_session, dialect_insert
+from ..mail import SmtpSettings, enqueue_email
 from ..models import User
 from ..utils import next_month
 
 
 def absolute_url_for(endpoint: str) -> str:
-    """Build an absolute URL for OAuth redirects, preferring APP_BASE_URL."""
+    """Build an absolute URL for OAuth redirects and email links, preferring APP_BASE_URL.
+
+    With APP_BASE_URL set the result doesn't depend on the request, so it is built once per app.
+    """
     base = current_app.config.get("APP_BASE_URL")
-    if base:
-        base = str(base).rstrip("/")
-        path = url_for(endpoint)
-        return f"{base}{path}"
-    return url_for(endpoint, _external=True)
+    if not base:
+        return url_for(endpoint, _external=True)
+    cache: dict[str, str] = current_app.extensions.setdefault("auth_absolute_urls", {})
+    url = cache.get(endpoint)
+    if url is None:
+        url = cache[endpoint] = f"{str(base).rstrip('/')}{url_for(endpoint)}"
+    return url
+
+
+def oauth_authorize_prefix(
+    authorize_url: str, callback_endpoint: str, client_id: str, scopes: str, **extra: str
+) -> str:
+    """Provider authorization URL with every parameter except `state`; callers append `&state=`.
+
+    Only `state` varies per request, so the encoded query is built once per app (as long as the
+    redirect URI comes from APP_BASE_URL rather than the request host).
+    """
+    key = (authorize_url, callback_endpoint, client_id, scopes, tuple(sorted(extra.items())))
+    cache: dict[tuple, str] = current_app.extensions.setdefault("auth_oauth_prefixes", {})
+    prefix = cache.get(key)
+    if prefix is None:
+        params = {
+            "response_type": "code",
+            "client_id": client_id,
+            "redirect_uri": absolute_url_for(callback_endpoint),
+            "scope": scopes,
+            **extra,
+        }
+        prefix = f"{authorize_url}?{urlencode(params, quote_via=quote_plus)}"
+        if current_app.config.get("APP_BASE_URL"):
+            cache[key] = prefix
+    return prefix
+
+
+def normalize_email(raw: str | None) -> str:
+    """Canonical (stripped, lower-cased, interned) form of a submitted email; "" if blank."""
+    email = (raw or "").strip()
+    return sys.intern(email.lower()) if email else ""
+
+
+@lru_cache(maxsize=4096)
+def default_display_name(email: str | None) -> str | None:
+    """Name for a new account with none given: the email's first local-part word, capitalized."""
+    if not email:
+        return None
+    local = email.partition("@")[0]
+    return local.partition(".")[0].partition("_")[0].capitalize()
+
+
+# Password policy / email patterns, compiled once. The policy checks use `search` with plain
+# character classes, which scans the password once; WTForms' Regexp calls `match`, so the form gets
+# its own start-anchored `.*?` variants (still a single pass, since `match` only tries position 0).
+HAS_UPPER_RE = re.compile(r"[A-Z]")
+HAS_SPECIAL_RE = re.compile(r"[^A-Za-z0-9]")
+_UPPER_MATCH_RE = re.compile(r".*?[A-Z]")
+_SPECIAL_MATCH_RE = re.compile(r".*?[^A-Za-z0-9]")
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+PASSWORD_MIN_LEN = 8
+# Upper bound so oversized input is rejected before any pattern or KDF work
+PASSWORD_MAX_LEN = 128
+
+
+def password_meets_policy(pwd: str) -> bool:
+    """8-128 characters, with one uppercase letter and one non-alphanumeric character."""
+    return (
+        PASSWORD_MIN_LEN <= len(pwd) <= PASSWORD_MAX_LEN
+        and HAS_UPPER_RE.search(pwd) is not None
+        and HAS_SPECIAL_RE.search(pwd) is not None
+    )
+
+
+# The register form is defined once at import; if WTForms (or email_validator) is unavailable
+# we fall back to `_Minimal` below instead of failing at app import time.
+try:
+    from wtforms import Form, PasswordField, StringField
+    from wtforms.validators import DataRequired, Email, Length, Regexp
+
+    class _RegisterForm(Form):
+        email = StringField("Email", validators=[DataRequired(), Email(message="Enter a valid email")])
+        password = PasswordField(
+            "Password",
+            validators=[
+                DataRequired(),
+                Length(min=PASSWORD_MIN_LEN, message="Minimum 8 characters"),
+                Length(max=PASSWORD_MAX_LEN, message="Maximum 128 characters"),
+                Regexp(_UPPER_MATCH_RE, message="At least one uppercase letter"),
+                Regexp(_SPECIAL_MATCH_RE, message="At least one special character"),
+            ],
+        )
+        confirm_password = PasswordField(
+            "Confirm Password",
+            validators=[DataRequired(), Length(min=PASSWORD_MIN_LEN, max=PASSWORD_MAX_LEN)],
+        )
+
+except Exception:
+    _RegisterForm = None  # type: ignore[assignment,misc]
+
+
+class _Minimal:
+    def __init__(self, form_data: Any) -> None:
+        self.email = type("_", (), {"data": form_data.get("email", "")})
+        self.password = type("_", (), {"data": form_data.get("password", "")})
+        self.confirm_password = type("_", (), {"data": form_data.get("confirm_password", "")})
+
+    def validate(self) -> bool:
+        email_ok = bool(EMAIL_RE.match(self.email.data))
+        return email_ok and password_meets_policy(self.password.data)
 
 
 def register_form(request_form: Any):
-    """Create the register WTForm lazily to avoid import errors at app import time."""
-    try:
-        from wtforms import Form, PasswordField, StringField
-        from wtforms.validators import DataRequired, Email, Length, Regexp
-
-        class _Form(Form):
-            email = StringField("Email", validators=[DataRequired(), Email(message="Enter a valid email")])
-            password = PasswordField(
-                "Password",
-                validators=[
-                    DataRequired(),
-                    Length(min=8, message="Minimum 8 characters"),
-                    Regexp(r".*[A-Z].*", message="At least one uppercase letter"),
-                    Regexp(r".*[^A-Za-z0-9].*", message="At least one special character"),
-                ],
-            )
-            confirm_password = PasswordField(
-                "Confirm Password",
-                validators=[DataRequired(), Length(min=8)],
-            )
-
-        return _Form(request_form)
-    except Exception:
-
-        class _Minimal:
-            def __init__(self, form_data: Any) -> None:
-                self.email = type("_", (), {"data": form_data.get("email", "")})
-                self.password = type("_", (), {"data": form_data.get("password", "")})
-                self.confirm_password = type("_", (), {"data": form_data.get("confirm_password", "")})
-
-            def validate(self) -> bool:
-                import re
-
-                email_ok = bool(re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", self.email.data))
-                pwd = self.password.data
-                pwd_ok = len(pwd) >= 8 and any(c.isupper() for c in pwd) and any(not c.isalnum() for c in pwd)
-                return email_ok and pwd_ok
-
-        return _Minimal(request_form)
+    """Build the register form (WTForms when available, else the minimal fallback)."""
+    if _RegisterForm is not None:
+        return _RegisterForm(request_form)
+    return _Minimal(request_form)
+
+
+# Argon2id hashes are self-describing ("$argon2id$v=19$m=...") and verified with argon2-cffi;
+# any other method string is handed to werkzeug ("scrypt:...", "pbkdf2:...").
+_ARGON2_PREFIX = "$argon2"
+
+
+@lru_cache(maxsize=1)
+def _argon2_hasher() -> Any:
+    from argon2 import PasswordHasher
+
+    # OWASP's Argon2id baseline: 46 MiB, 1 pass, 1 lane
+    return PasswordHasher(time_cost=1, memory_cost=46 * 1024, parallelism=1)
+
+
+def _hash_method() -> str:
+    return current_app.config.get("AUTH_PW_HASH_METHOD", "argon2")
+
+
+def _hash_with(method: str, password: str) -> str:
+    if method == "argon2":
+        return _argon2_hasher().hash(password)
+    return generate_password_hash(password, method=method)
+
+
+def _check(password_hash: str, password: str) -> bool:
+    if password_hash.startswith(_ARGON2_PREFIX):
+        from argon2.exceptions import InvalidHashError, VerificationError
+
+        try:
+            return _argon2_hasher().verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(password_hash, password)
+
+
+def hash_password(password: str) -> str:
+    return _hash_with(_hash_method(), password)
+
+
+@lru_cache(maxsize=4)
+def _dummy_hash(method: str) -> str:
+    return _hash_with(method, secrets.token_urlsafe(16))
+
+
+def verify_password(password_hash: str | None, password: str) -> bool:
+    """Check `password`; with no stored hash, still pay one hash so unknown emails aren't faster."""
+    if not password_hash:
+        _check(_dummy_hash(_hash_method()), password)
+        return False
+    return _check(password_hash, password)
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True when `password_hash` wasn't made with the configured method/parameters."""
+    method = _hash_method()
+    if method == "argon2":
+        if not password_hash.startswith(_ARGON2_PREFIX):
+            return True
+        return _argon2_hasher().check_needs_rehash(password_hash)
+    if password_hash.startswith(_ARGON2_PREFIX):
+        return True
+    # werkzeug stores "<method>:<params>$salt$hash" with its defaults expanded ("scrypt" becomes
+    # "scrypt:32768:8:1"), so compare against the segment a hash made right now would carry.
+    return password_hash.split("$", 1)[0] != _dummy_hash(method).split("$", 1)[0]
 
 
 def _serializer(salt: str) -> URLSafeTimedSerializer:
-    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=salt)
+    # Serializers are immutable; build one per (app, salt) and keep it on the app.
+    cache: dict[str, URLSafeTimedSerializer] = current_app.extensions.setdefault("auth_serializers", {})
+    serializer = cache.get(salt)
+    if serializer is None:
+        serializer = cache[salt] = URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=salt)
+    return serializer
+
+
+# Magic-link tokens: urlsafe-b64(b"<exp>:<email>" + truncated HMAC-SHA256); no JSON/timestamp codec
+MAGIC_TOKEN_TTL_S = 3600
+_MAGIC_SIG_LEN = 16
+
+
+@lru_cache(maxsize=4)
+def _magic_key(secret: str) -> bytes:
+    # Domain-separate from the other SECRET_KEY uses (session cookie, serializers)
+    return hmac.new(secret.encode("utf-8"), b"magic-link", hashlib.sha256).digest()
 
 
-def magic_serializer() -> URLSafeTimedSerializer:
-    return _serializer("magic")
+def _magic_sig(payload: bytes) -> bytes:
+    key = _magic_key(current_app.config["SECRET_KEY"])
+    return hmac.new(key, payload, hashlib.sha256).digest()[:_MAGIC_SIG_LEN]
+
+
+def make_magic_token(email: str) -> str:
+    payload = f"{int(time.time()) + MAGIC_TOKEN_TTL_S}:{email}".encode("utf-8")
+    return base64.urlsafe_b64encode(payload + _magic_sig(payload)).rstrip(b"=").decode("ascii")
+
+
+def load_magic_token(token: str) -> str | None:
+    """Return the email for a valid, unexpired magic-link token, else None."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    payload, sig = raw[:-_MAGIC_SIG_LEN], raw[-_MAGIC_SIG_LEN:]
+    if not payload or not hmac.compare_digest(sig, _magic_sig(payload)):
+        return None
+    exp, sep, email = payload.decode("utf-8", errors="replace").partition(":")
+    if not sep or not exp.isdigit() or int(exp) < time.time():
+        return None
+    return email
 
 
 def confirm_serializer() -> URLSafeTimedSerializer:
@@ -82,6 +268,110 @@ def reset_serializer() -> URLSafeTimedSerializer:
     return _serializer("reset")
 
 
+def share_serializer() -> URLSafeTimedSerializer:
+    return _serializer("linkedin-share")
+
+
+# email -> user id. Ids never change for an address, so only hits are cached (a miss may become
+# a signup any moment); entries are dropped via `forget_user_email` when a user row is (re)written.
+_USER_ID_CACHE_MAX = 1024
+_user_id_cache: OrderedDict[str, str] = OrderedDict()
+_user_id_cache_lock = threading.Lock()
+_SEL_USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+
+
+def _cached_user_id(email: str) -> str | None:
+    if has_request_context():
+        uid = g.get("user_ids_by_email", {}).get(email)
+        if uid is not None:
+            return uid
+    with _user_id_cache_lock:
+        uid = _user_id_cache.get(email)
+        if uid is not None:
+            _user_id_cache.move_to_end(email)
+    return uid
+
+
+def _remember_user_id(email: str, uid: str) -> None:
+    with _user_id_cache_lock:
+        _user_id_cache[email] = uid
+        _user_id_cache.move_to_end(email)
+        if len(_user_id_cache) > _USER_ID_CACHE_MAX:
+            _user_id_cache.popitem(last=False)
+    if has_request_context():
+        g.setdefault("user_ids_by_email", {})[email] = uid
+
+
+def load_user_by_email(session_db: Any, email: str) -> User | None:
+    """Full User for `email`, via the primary-key/identity-map path when the id is already known.
+
+    The result is kept on `g.user` so the session's weak-referencing identity map holds on to it
+    for the rest of the request and later lookups stay on the `get()` path.
+    """
+    uid = _cached_user_id(email)
+    user = session_db.get(User, uid) if uid is not None else None
+    if user is None or user.email != email:
+        if uid is not None:
+            forget_user_email(email)
+        user = session_db.execute(_SEL_USER_BY_EMAIL, {"email": email}).scalar_one_or_none()
+        if user is not None:
+            _remember_user_id(email, user.id)
+    if user is not None and has_request_context():
+        g.user = user
+    return user
+
+
+def find_oauth_user(
+    session_db: Any, *, provider: str, sub: str | None, email: str | None
+) -> tuple[User | None, str | None]:
+    """One query for both OAuth callback lookups: (user with this identity, id owning `email`)."""
+    conditions = []
+    if sub:
+        conditions.append(and_(User.oauth_provider == provider, User.oauth_sub == sub))
+    if email:
+        conditions.append(User.email == email)
+    if not conditions:
+        return None, None
+    by_identity: User | None = None
+    email_owner_id: str | None = None
+    for user in session_db.execute(select(User).where(or_(*conditions)).limit(2)).scalars():
+        if sub and user.oauth_provider == provider and user.oauth_sub == sub:
+            by_identity = user
+        if email and user.email == email:
+            email_owner_id = user.id
+            _remember_user_id(email, user.id)
+    return by_identity, email_owner_id
+
+
+def forget_user_email(email: str) -> None:
+    with _user_id_cache_lock:
+        _user_id_cache.pop(email, None)
+    if has_request_context():
+        g.get("user_ids_by_email", {}).pop(email, None)
+
+
+# Transactional emails differ only in their link, so each template is rendered once per app with
+# a placeholder and the (escaped) link is substituted per send.
+_LINK_PLACEHOLDER = "__LINKERHERO_EMAIL_LINK__"
+
+
+def link_email_html(template: str, link_var: str, link: str) -> str:
+    """HTML body of `template` with `link_var` set to `link` (rendered once per app, then cached)."""
+    cache: dict[str, str] = current_app.extensions.setdefault("auth_email_html", {})
+    html = cache.get(template)
+    if html is None:
+        html = render_template(
+            template,
+            app_name="LinkerHero",
+            app_base_url=current_app.config.get("APP_BASE_URL", ""),
+            **{link_var: _LINK_PLACEHOLDER},
+        )
+        # Keep picking up template edits while developing
+        if not current_app.debug:
+            cache[template] = html
+    return html.replace(_LINK_PLACEHOLDER, str(escape(link)))
+
+
 def send_email(to_email: str, subject: str, body: str, html_body: str | None = None) -> None:
     mail_from = current_app.config.get("MAIL_FROM")
     host = current_app.config.get("SMTP_HOST")
@@ -100,20 +390,70 @@ def send_email(to_email: str, subject: str, body: str, html_body: str | None = N
     msg.set_content(body)
     if html_body:
         msg.add_alternative(html_body, subtype="html")
-    with smtplib.SMTP(host, port) as smtp:
-        smtp.starttls()
-        if user and pwd:
-            smtp.login(user, pwd)
-        smtp.send_message(msg)
+    # Delivery happens on a background thread over a reused SMTP connection
+    enqueue_email(SmtpSettings(host=host, port=int(port), user=user, password=pwd), msg)
 
 
-def ensure_admin(email: str) -> None:
+def ensure_admin(email: str) -> str:
+    """Create or promote `email` to the admin plan; returns the user id."""
+    email = normalize_email(email)
+    now = datetime.now(timezone.utc)
+    users = User.__table__
+    stmt = (
+        dialect_insert(users)
+        .values(email=email, plan="admin", plan_started_at=now, plan_renews_at=next_month(now))
+        .on_conflict_do_update(index_elements=["email"], set_={"plan": "admin"})
+        .returning(users.c.id, users.c.plan)
+    )
     with db_session() as session_db:
-        user = session_db.execute(select(User).where(User.email == email)).scalar_one_or_none()
-        if user is None:
-            now = datetime.now(timezone.utc)
-            user = User(email=email, plan="admin", plan_started_at=now, plan_renews_at=next_month(now))
-            session_db.add(user)
-        else:
-            session_db.execute(update(User).where(User.id == user.id).values(plan="admin"))
+        row = session_db.execute(stmt).one()
+    forget_user_email(email)
+    return row.id
+
+
+def upsert_oauth_user(
+    session_db: Any,
+    *,
+    provider: str,
+    sub: str | None,
+    email: str,
+    display_name: str | None,
+    given_name: str | None,
+    full_name: str | None,
+    picture: str | None,
+    now: datetime,
+) -> str:
+    """Find-or-create the user for a provider-verified `email` in one statement; returns the id.
 
+    New rows get the provider identity and `display_name`. Existing rows keep their auth method;
+    only empty profile fields are filled in (the name from `given_name`) and the email is verified.
+    """
+    users = User.__table__
+    stmt = (
+        dialect_insert(users)
+        .values(
+            email=email,
+            display_name=display_name,
+            full_name=full_name,
+            profile_image_url=picture,
+            profile_source=provider,
+            oauth_provider=provider,
+            oauth_sub=sub,
+            plan="free",
+            plan_started_at=now,
+            plan_renews_at=next_month(now),
+            email_verified_at=now,
+        )
+        .on_conflict_do_update(
+            index_elements=["email"],
+            set_={
+                "display_name": func.coalesce(users.c.display_name, given_name),
+                "full_name": func.coalesce(users.c.full_name, full_name),
+                "profile_image_url": func.coalesce(users.c.profile_image_url, picture),
+                "profile_source": func.coalesce(users.c.profile_source, provider),
+                "email_verified_at": func.coalesce(users.c.email_verified_at, now),
+            },
+        )
+        .returning(users.c.id)
+    )
+    return session_db.execute(stmt).scalar_one()
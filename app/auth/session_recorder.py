@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
+from flask import Flask, current_app
+from sqlalchemy import insert, select
+
+from ..db import db_session, dialect_insert
+from ..models import Session as UserSession, UserAgent
+
+logger = logging.getLogger(__name__)
+
+# Login audit rows are written off the request path, in batches of up to _BATCH_MAX rows or
+# whatever arrived within _BATCH_WAIT_S, with one executemany INSERT per batch.
+_BATCH_MAX = 100
+_BATCH_WAIT_S = 1.0
+_SHUTDOWN_TIMEOUT_S = 10.0
+
+# None is the shutdown sentinel
+_queue: queue.Queue[tuple[Flask, dict[str, Any]] | None] = queue.Queue(maxsize=10_000)
+
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+# sha256(User-Agent) -> user_agents.id, per app; a handful of browsers cover nearly every login
+_UA_IDS_MAX = 4096
+# Longer User-Agent headers are cut here, once for every login path, before they are hashed/stored.
+# Matches the legacy sessions.user_agent width, so a migration downgrade can copy UAs back intact.
+_UA_MAX_CHARS = 400
+
+
+def _ua_ids(session_db: Any, app: Flask, user_agents: set[str]) -> dict[str, int]:
+    """Map each User-Agent string to its `user_agents` id, inserting the ones not seen before."""
+    cache: dict[bytes, int] = app.extensions.setdefault("user_agent_ids", {})
+    ids: dict[str, int] = {}
+    missing: dict[bytes, str] = {}
+    for ua in user_agents:
+        digest = hashlib.sha256(ua.encode("utf-8")).digest()
+        ua_id = cache.get(digest)
+        if ua_id is None:
+            missing[digest] = ua
+        else:
+            ids[ua] = ua_id
+    if missing:
+        table = UserAgent.__table__
+        session_db.execute(
+            dialect_insert(table).on_conflict_do_nothing(index_elements=["sha256"]),
+            [{"sha256": digest, "ua": ua} for digest, ua in missing.items()],
+        )
+        found = session_db.execute(
+            select(table.c.sha256, table.c.id).where(table.c.sha256.in_(list(missing)))
+        ).all()
+        if len(cache) + len(found) > _UA_IDS_MAX:
+            cache.clear()
+        for digest, ua_id in found:
+            digest = bytes(digest)
+            cache[digest] = ua_id
+            ids[missing[digest]] = ua_id
+    return ids
+
+
+def _write(app: Flask, rows: list[dict[str, Any]]) -> None:
+    with app.app_context():
+        with db_session() as session_db:
+            ua_ids = _ua_ids(session_db, app, {row["user_agent"] for row in rows if row["user_agent"]})
+            for row in rows:
+                ua = row.pop("user_agent")
+                row["user_agent_id"] = ua_ids.get(ua) if ua else None
+            session_db.execute(insert(UserSession.__table__), rows)
+
+
+def _flush(batch: list[tuple[Flask, dict[str, Any]]]) -> None:
+    by_app: dict[Flask, list[dict[str, Any]]] = {}
+    for app, row in batch:
+        by_app.setdefault(app, []).append(row)
+    for app, rows in by_app.items():
+        try:
+            _write(app, rows)
+        except Exception:
+            logger.exception("Failed to record %d login session rows", len(rows))
+
+
+def _worker_loop() -> None:
+    while True:
+        item = _queue.get()
+        if item is None:
+            return
+        batch = [item]
+        stop = False
+        deadline = time.monotonic() + _BATCH_WAIT_S
+        while len(batch) < _BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = _queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        _flush(batch)
+        if stop:
+            return
+
+
+def start_worker() -> None:
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="session-recorder", daemon=True)
+            _worker.start()
+
+
+def _shutdown_worker() -> None:
+    """Flush queued rows before the interpreter exits."""
+    worker = _worker
+    if worker is None or not worker.is_alive():
+        return
+    try:
+        _queue.put(None, timeout=_SHUTDOWN_TIMEOUT_S)
+    except queue.Full:
+        return
+    worker.join(timeout=_SHUTDOWN_TIMEOUT_S)
+
+
+atexit.register(_shutdown_worker)
+
+
+def record_session(user_id: str, user_agent: str | None, ip_address: str | None, now: datetime) -> None:
+    """Queue a `sessions` row for a successful login; written asynchronously in batches."""
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    row = {
+        "user_id": user_id,
+        "user_agent": user_agent[:_UA_MAX_CHARS] if user_agent else None,
+        "ip_address": ip_address,
+        "created_at": now,
+        "last_seen_at": now,
+    }
+    start_worker()
+    try:
+        _queue.put_nowait((app, row))
+    except queue.Full:
+        _write(app, [row])
@@ -55,10 +55,13 @@ class Config:
     # Robust connection pooling for cloud Postgres (e.g., Neon) to avoid stale connections
     SQLALCHEMY_ENGINE_OPTIONS: dict[str, Any] = field(
         default_factory=lambda: {
-            "pool_pre_ping": True,
+            # Pre-ping costs a SELECT 1 per checkout; deployments whose DB doesn't drop idle
+            # connections (pool_recycle below already retires them) can turn it off.
+            "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in {"1", "true", "yes"},
             "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
-            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
-            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            # Sized for gunicorn's 4 threads/worker plus bursts from /magic and RSS refreshes
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
             "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
         }
     )
@@ -66,6 +69,10 @@ class Config:
     SESSION_COOKIE_SECURE: bool = FLASK_ENV == "production"
     SESSION_COOKIE_HTTPONLY: bool = True
     SESSION_COOKIE_SAMESITE: str = "Lax"
+    # "cookie" keeps Flask's signed-cookie session; "redis" stores sessions server-side via
+    # Flask-Session so the cookie only carries a session id (costs one Redis round-trip per request)
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "cookie").lower()
+    SESSION_REDIS_URL: str | None = os.getenv("SESSION_REDIS_URL") or os.getenv("REDIS_URL")
 
     # Email settings - support your Gmail setup
     MAIL_FROM: str | None = os.getenv("MAIL_DEFAULT_SENDER") or os.getenv("MAIL_FROM")
@@ -87,7 +94,8 @@ class Config:
 
     APP_BASE_URL: str = os.getenv("APP_BASE_URL", "http://localhost:5000")
 
-    # Stripe
+    # Stripe (set BILLING_ENABLED=false to skip the billing blueprint and the Stripe import)
+    BILLING_ENABLED: bool = os.getenv("BILLING_ENABLED", "true").lower() in {"1", "true", "yes"}
     STRIPE_PUBLISHABLE_KEY: str | None = os.getenv("STRIPE_PUBLISHABLE_KEY")
     STRIPE_SECRET_KEY: str | None = os.getenv("STRIPE_SECRET_KEY")
 
@@ -132,6 +140,11 @@ class Config:
     ARTICLE_EXTRACT_MIN_CHARS: int = int(os.getenv("ARTICLE_EXTRACT_MIN_CHARS", "600"))
     ARTICLE_CONTENT_TTL_HOURS: int = int(os.getenv("ARTICLE_CONTENT_TTL_HOURS", "168"))  # 7 days
 
+    # Password hashing method: "argon2" (Argon2id via argon2-cffi) or a werkzeug method string such as
+    # "scrypt:32768:8:1". Hashes from another method are upgraded on the next successful password login.
+    # Tests/dev can use a cheap value, e.g. "pbkdf2:sha256:1000".
+    AUTH_PW_HASH_METHOD: str = os.getenv("AUTH_PW_HASH_METHOD", "argon2")
+
     # OAuth account linking behavior:
     # - true (default): if an existing user has the same email, OAuth will sign into that user (merged account).
     # - false: OAuth will only sign into a user if oauth_provider+oauth_sub match; if email already exists under a
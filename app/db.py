@@ -2,6 +2,9 @@ from __future__ import annotations
 
 from flask_sqlalchemy import SQLAlchemy
 from contextlib import contextmanager
+from typing import Any, Iterable
+
+from sqlalchemy import update
 
 db = SQLAlchemy()
 
@@ -15,3 +18,18 @@ def db_session():
         session.rollback()
         raise
 
+
+def dialect_insert(table: Any) -> Any:
+    """INSERT construct for the bound dialect, exposing `on_conflict_do_*` (Postgres and SQLite)."""
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def bulk_update_where(model: Any, where_clauses: Iterable[Any], values: dict[str, Any]) -> int:
+    """Apply `values` to all rows of `model` matching `where_clauses` in one UPDATE; return rowcount."""
+    with db_session() as session:
+        res = session.execute(update(model).where(*where_clauses).values(**values))
+    return res.rowcount
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import atexit
+import importlib.util
+import os
+import threading
+
+import httpx
+
+# Shared client for outbound provider calls (OAuth token/userinfo, LinkedIn UGC), so repeated calls
+# to the same host reuse a kept-alive TLS connection instead of handshaking per request.
+_TIMEOUT = httpx.Timeout(20.0, connect=5.0)
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+_client: httpx.Client | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    return importlib.util.find_spec("h2") is not None
+
+
+def http_client() -> httpx.Client:
+    """Return this process's shared client, creating it on first use (and again after a fork)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = httpx.Client(http2=_http2_available(), timeout=_TIMEOUT, limits=_LIMITS)
+            _client_pid = pid
+    return _client
+
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            try:
+                _client.close()
+            except Exception:
+                pass
+        _client = None
+
+
+atexit.register(close_client)
@@ -21,10 +21,15 @@ def _rate_key() -> str:
     return _client_ip()
 
 
+# RATELIMIT_STORAGE_URI=memory:// keeps counters in-process (no Redis round-trip per limit) for
+# single-worker deployments; otherwise limits share REDIS_URL across workers.
 limiter = Limiter(
     key_func=_rate_key,
-    storage_uri=os.getenv("REDIS_URL", "memory://"),
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI") or os.getenv("REDIS_URL", "memory://"),
+    # fixed-window is a single INCR per limit; moving-window would cost more per check on Redis
     strategy="fixed-window",
+    # If Redis is unreachable, fall back to per-process counters instead of failing auth requests
+    in_memory_fallback_enabled=True,
     application_limits=[],
     default_limits=[],
     headers_enabled=True,
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+from dataclasses import dataclass
+from email.message import EmailMessage
+
+logger = logging.getLogger(__name__)
+
+# Close the pooled connection after this many idle seconds (servers drop idle sessions anyway)
+_IDLE_TIMEOUT_S = 60.0
+_SMTP_TIMEOUT_S = 30.0
+# How long interpreter shutdown waits for queued mail to drain
+_SHUTDOWN_TIMEOUT_S = 10.0
+
+
+@dataclass(frozen=True)
+class SmtpSettings:
+    host: str
+    port: int
+    user: str | None = None
+    password: str | None = None
+
+
+# Bounded so a dead SMTP server can't grow memory without limit; None is the shutdown sentinel
+MAIL_QUEUE: queue.Queue[tuple[SmtpSettings, EmailMessage] | None] = queue.Queue(maxsize=1000)
+
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+# Process-wide SMTP connection, reused across sends; guarded by _smtp_lock
+_smtp_lock = threading.Lock()
+_smtp_conn: smtplib.SMTP | None = None
+_smtp_settings: SmtpSettings | None = None
+
+
+def _connect(settings: SmtpSettings) -> smtplib.SMTP:
+    smtp = smtplib.SMTP(settings.host, settings.port, timeout=_SMTP_TIMEOUT_S)
+    smtp.starttls()
+    if settings.user and settings.password:
+        smtp.login(settings.user, settings.password)
+    return smtp
+
+
+def _drop_connection() -> None:
+    """Close the shared connection (caller holds _smtp_lock)."""
+    global _smtp_conn, _smtp_settings
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.quit()
+        except Exception:
+            pass
+    _smtp_conn, _smtp_settings = None, None
+
+
+def _live_connection(settings: SmtpSettings) -> smtplib.SMTP:
+    """Return the shared connection if it is healthy for `settings`, else reconnect (lock held)."""
+    global _smtp_conn, _smtp_settings
+    if _smtp_conn is not None and _smtp_settings == settings:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+    _drop_connection()
+    _smtp_conn, _smtp_settings = _connect(settings), settings
+    return _smtp_conn
+
+
+def send_pooled(settings: SmtpSettings, msg: EmailMessage) -> None:
+    """Send `msg` over the shared connection, reconnecting once if the server dropped it."""
+    with _smtp_lock:
+        for attempt in range(2):
+            try:
+                _live_connection(settings).send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                _drop_connection()
+                if attempt:
+                    raise
+            except Exception:
+                _drop_connection()
+                raise
+
+
+def close_connection() -> None:
+    with _smtp_lock:
+        _drop_connection()
+
+
+atexit.register(close_connection)
+
+
+def _worker_loop() -> None:
+    """Drain MAIL_QUEUE through the shared SMTP connection; close it when idle."""
+    while True:
+        try:
+            item = MAIL_QUEUE.get(timeout=_IDLE_TIMEOUT_S)
+        except queue.Empty:
+            close_connection()
+            continue
+        if item is None:
+            MAIL_QUEUE.task_done()
+            return
+        settings, msg = item
+        try:
+            send_pooled(settings, msg)
+        except Exception:
+            logger.exception("Failed to send email to %s", msg.get("To"))
+        finally:
+            MAIL_QUEUE.task_done()
+
+
+def start_worker() -> None:
+    """Start the background sender for this process if it isn't running (idempotent, fork-safe)."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="smtp-sender", daemon=True)
+            _worker.start()
+
+
+def _shutdown_worker() -> None:
+    """Let the sender drain what's queued, then stop it."""
+    worker = _worker
+    if worker is None or not worker.is_alive():
+        return
+    try:
+        MAIL_QUEUE.put(None, timeout=_SHUTDOWN_TIMEOUT_S)
+    except queue.Full:
+        return
+    worker.join(timeout=_SHUTDOWN_TIMEOUT_S)
+
+
+# Registered after close_connection so it runs first (atexit is LIFO)
+atexit.register(_shutdown_worker)
+
+
+def enqueue_email(settings: SmtpSettings, msg: EmailMessage) -> None:
+    """Queue a message for the background sender and return immediately."""
+    start_worker()
+    try:
+        MAIL_QUEUE.put_nowait((settings, msg))
+    except queue.Full:
+        # Backpressure: send inline rather than dropping the email
+        logger.warning("Mail queue full; sending to %s synchronously", msg.get("To"))
+        send_pooled(settings, msg)
@@ -4,7 +4,7 @@ import uuid
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import JSON, Boolean, DateTime, Integer, String, Text, func, UniqueConstraint, ForeignKey
+from sqlalchemy import JSON, Boolean, DateTime, Integer, LargeBinary, String, Text, func, UniqueConstraint, ForeignKey
 from .db import db
 
 
@@ -61,6 +61,16 @@ class User(db.Model):
     )
 
 
+# Case-insensitive uniqueness; every write path stores emails already lower-cased (normalize_email)
+db.Index("users_email_lower_idx", func.lower(User.email), unique=True)
+# Lets the password-login lookup (id, password_hash, email_verified_at by email) be an index-only scan
+db.Index(
+    "users_email_login_idx",
+    User.email,
+    postgresql_include=["id", "password_hash", "email_verified_at"],
+)
+
+
 class Article(db.Model):
     __tablename__ = "articles"
 
@@ -147,15 +157,27 @@ class Session(db.Model):
 
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
     user_id = db.Column(db.String(36), ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
-    user_agent = db.Column(db.String(400), nullable=True)
+    # Legacy copy of the UA, no longer written (see user_agent_id); dropped once the lookup is verified
+    user_agent_legacy = db.Column("user_agent", db.String(400), nullable=True)
+    user_agent_id = db.Column(Integer, ForeignKey("user_agents.id"), nullable=True)
     ip_address = db.Column(db.String(50), nullable=True)
     created_at = db.Column(DateTime(timezone=True), server_default=func.now(), index=True, nullable=False)
     last_seen_at = db.Column(DateTime(timezone=True), nullable=True, index=True)
     revoked_at = db.Column(DateTime(timezone=True), nullable=True)
     expires_at = db.Column(DateTime(timezone=True), nullable=True)
 
-    # ORM relationship
+    # ORM relationships
     user = db.relationship("User", back_populates="sessions")
+    user_agent = db.relationship("UserAgent")
+
+
+class UserAgent(db.Model):
+    __tablename__ = "user_agents"
+
+    # Each distinct User-Agent string is stored once (keyed by its SHA-256) and referenced by id
+    id = db.Column(Integer, primary_key=True, autoincrement=True)
+    sha256 = db.Column(LargeBinary(32), unique=True, nullable=False)
+    ua = db.Column(Text, nullable=False)
 
 
 class Subscription(db.Model):
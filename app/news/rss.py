@@ -18,16 +18,19 @@ from typing import Any, Optional
 
 import aiohttp
 import feedparser
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, insert
 
-from ..db import db_session
-from ..models import Article, Category, ArticleCategory
+from ..db import db_session, dialect_insert
+from ..models import Article, Category, ArticleCategory, generate_uuid
 from .feeds_config import CATEGORIES, get_feeds_for_category, get_category_slugs, get_all_feeds
 from .url_validator import validate_url, is_url_safe
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
 logger = logging.getLogger(__name__)
 
+# Max rows per multi-row INSERT when saving new feed entries
+_INSERT_BATCH_SIZE = 500
+
 
 def _normalize_url(url: str) -> str:
     """
@@ -468,6 +471,35 @@ def _save_entries_to_db(entries: list[dict], category_slug: str) -> int:
         existing_url_to_id: dict[str, str] = {}
         for article_id, url in s.execute(select(Article.id, Article.url)).all():
             existing_url_to_id[_normalize_url(url)] = article_id
+
+        # New articles are written in chunks: one multi-row INSERT for articles, one for links
+        pending_articles: list[dict[str, Any]] = []
+        pending_links: dict[str, str] = {}
+
+        def _flush_pending() -> None:
+            nonlocal added_count
+            if not pending_articles:
+                return
+            articles = Article.__table__
+            # ON CONFLICT guards against a concurrent refresh inserting the same URL
+            inserted_ids = s.execute(
+                dialect_insert(articles)
+                .values(pending_articles)
+                .on_conflict_do_nothing(index_elements=["url"])
+                .returning(articles.c.id)
+            ).scalars().all()
+            if inserted_ids:
+                s.execute(
+                    insert(ArticleCategory.__table__).values(
+                        [
+                            {"id": generate_uuid(), "article_id": aid, "category_id": pending_links[aid]}
+                            for aid in inserted_ids
+                        ]
+                    )
+                )
+            added_count += len(inserted_ids)
+            pending_articles.clear()
+            pending_links.clear()
         
         for entry in entries:
             link = entry["link"]
@@ -484,6 +516,10 @@ def _save_entries_to_db(entries: list[dict], category_slug: str) -> int:
             existing_article_id = existing_url_to_id.get(normalized_link)
             if existing_article_id:
                 skipped_duplicate += 1
+                if existing_article_id in pending_links:
+                    # Not written yet: just retarget the queued link
+                    pending_links[existing_article_id] = category.id
+                    continue
                 # Enforce: each article belongs to exactly one category based on its feed URL.
                 # This prevents cross-category contamination when a URL is seen in multiple refreshes.
                 s.execute(
@@ -530,29 +566,27 @@ def _save_entries_to_db(entries: list[dict], category_slug: str) -> int:
             # Get source name from entry and normalize to avoid duplicates
             source_name = _normalize_source_name(entry.get("source_name", "Unknown"))
             
-            # Create article
-            article = Article(
-                source=entry.get("feed_url", ""),
-                source_name=source_name,
-                url=link,
-                title=title[:1000],
-                summary=summary[:5000] if summary else "",
-                topics=_keywords(title, summary),
-                image_url=img_url,
-                published_at=published_at,
-            )
-            s.add(article)
-            s.flush()
-            
-            # Link to category
-            article_category = ArticleCategory(
-                article_id=article.id,
-                category_id=category.id,
+            # Queue article (+ its category link) for the next batched INSERT
+            article_id = generate_uuid()
+            pending_articles.append(
+                {
+                    "id": article_id,
+                    "source": entry.get("feed_url", ""),
+                    "source_name": source_name,
+                    "url": link,
+                    "title": title[:1000],
+                    "summary": summary[:5000] if summary else "",
+                    "topics": _keywords(title, summary),
+                    "image_url": img_url,
+                    "published_at": published_at,
+                }
             )
-            s.add(article_category)
-            
-            existing_url_to_id[normalized_link] = article.id
-            added_count += 1
+            pending_links[article_id] = category.id
+            existing_url_to_id[normalized_link] = article_id
+            if len(pending_articles) >= _INSERT_BATCH_SIZE:
+                _flush_pending()
+
+        _flush_pending()
     
     logger.info(f"Category {category_slug}: Added {added_count}, Duplicates skipped: {skipped_duplicate}, No title: {skipped_no_title}")
     return added_count
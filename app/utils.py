@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timezone
 import calendar
 
+from flask import g, has_request_context
+
 
 def next_month(dt: datetime) -> datetime:
     """Return dt advanced by one calendar month, clamping the day if needed."""
@@ -13,3 +15,13 @@ def next_month(dt: datetime) -> datetime:
     return dt.replace(year=year, month=month, day=day)
 
 
+
+
+def request_now() -> datetime:
+    """Current UTC time, taken once per request (memoized on `g`); fresh outside requests."""
+    if not has_request_context():
+        return datetime.now(timezone.utc)
+    now = g.get("now_utc")
+    if now is None:
+        now = g.now_utc = datetime.now(timezone.utc)
+    return now
@@ -0,0 +1,75 @@
+"""
+Revision ID: a3c9e4f7d210
+Revises: f1a4d6c8b2e7
+Create Date: 2026-10-16 12:20:00.000000
+"""
+
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'a3c9e4f7d210'
+down_revision = 'f1a4d6c8b2e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_agents',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('sha256', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('ua', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256'),
+    )
+    op.add_column('sessions', sa.Column('user_agent_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'sessions_user_agent_id_fkey', 'sessions', 'user_agents', ['user_agent_id'], ['id']
+    )
+
+    # Move the distinct strings already stored on sessions into the lookup table, set-based.
+    # sessions.user_agent itself is kept for now and dropped in a later revision.
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        op.execute(
+            sa.text(
+                "INSERT INTO user_agents (sha256, ua) "
+                "SELECT sha256(convert_to(user_agent, 'UTF8')), user_agent "
+                "FROM (SELECT DISTINCT user_agent FROM sessions WHERE user_agent IS NOT NULL) s"
+            )
+        )
+    else:
+        user_agents = sa.table(
+            'user_agents',
+            sa.column('sha256', sa.LargeBinary()),
+            sa.column('ua', sa.Text()),
+        )
+        rows = bind.execute(
+            sa.text("SELECT DISTINCT user_agent FROM sessions WHERE user_agent IS NOT NULL")
+        ).scalars().all()
+        if rows:
+            bind.execute(
+                sa.insert(user_agents),
+                [{"sha256": hashlib.sha256(ua.encode("utf-8")).digest(), "ua": ua} for ua in rows],
+            )
+    op.execute(
+        sa.text(
+            "UPDATE sessions SET user_agent_id = ua.id "
+            "FROM user_agents ua WHERE ua.ua = sessions.user_agent"
+        )
+    )
+
+
+def downgrade() -> None:
+    # Rows recorded after the upgrade only have user_agent_id; copy their UA back first
+    op.execute(
+        sa.text(
+            "UPDATE sessions SET user_agent = ua.ua "
+            "FROM user_agents ua WHERE ua.id = sessions.user_agent_id AND sessions.user_agent IS NULL"
+        )
+    )
+    op.drop_constraint('sessions_user_agent_id_fkey', 'sessions', type_='foreignkey')
+    op.drop_column('sessions', 'user_agent_id')
+    op.drop_table('user_agents')
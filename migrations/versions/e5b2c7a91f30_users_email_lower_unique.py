@@ -0,0 +1,38 @@
+"""
+Revision ID: e5b2c7a91f30
+Revises: 0286ee01ea54
+Create Date: 2026-10-16 10:12:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e5b2c7a91f30'
+down_revision = '0286ee01ea54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lower-casing would collide on the unique email constraint for case-only duplicates; those
+    # accounts have to be merged by hand first.
+    conflicts = op.get_bind().execute(
+        sa.text(
+            "SELECT lower(email), count(*) FROM users GROUP BY lower(email) HAVING count(*) > 1 "
+            "ORDER BY 1"
+        )
+    ).all()
+    if conflicts:
+        listing = ", ".join(f"{email} ({count} accounts)" for email, count in conflicts)
+        raise RuntimeError(
+            "Cannot enforce case-insensitive unique emails: these addresses exist in more than one "
+            f"letter case and must be merged first: {listing}"
+        )
+
+    # Stored emails are lower-cased by the app; this makes case-only duplicates impossible.
+    op.execute(sa.text("UPDATE users SET email = lower(email) WHERE email <> lower(email)"))
+    op.create_index("users_email_lower_idx", "users", [sa.text("lower(email)")], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("users_email_lower_idx", table_name="users")
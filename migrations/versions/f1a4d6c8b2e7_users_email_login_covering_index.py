@@ -0,0 +1,43 @@
+"""
+Revision ID: f1a4d6c8b2e7
+Revises: e5b2c7a91f30
+Create Date: 2026-10-16 11:05:00.000000
+"""
+
+from alembic import op
+
+revision = 'f1a4d6c8b2e7'
+down_revision = 'e5b2c7a91f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # Built without locking users against logins/signups; CONCURRENTLY can't run in a transaction
+        with op.get_context().autocommit_block():
+            op.create_index(
+                "users_email_login_idx",
+                "users",
+                ["email"],
+                postgresql_include=["id", "password_hash", "email_verified_at"],
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+    else:
+        op.create_index("users_email_login_idx", "users", ["email"])
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                "users_email_login_idx",
+                table_name="users",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+    else:
+        op.drop_index("users_email_login_idx", table_name="users")
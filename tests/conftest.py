@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 import sys
 from pathlib import Path
 
@@ -7,3 +8,5 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+# Tests don't need production-strength password hashing; keep register/login fast.
+os.environ.setdefault("AUTH_PW_HASH_METHOD", "pbkdf2:sha256:1000")
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+
+
+def test_ensure_admin_upserts_existing_and_new_users():
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from app import create_app
+    from app.auth.services import ensure_admin
+    from app.db import db
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+
+        db.session.add(User(email="existing@example.com", plan="free"))
+        db.session.commit()
+
+        existing_id = ensure_admin("existing@example.com")
+        new_id = ensure_admin("new@example.com")
+        db.session.expire_all()
+
+        users = {u.email: u for u in db.session.query(User).all()}
+        assert users["existing@example.com"].id == existing_id
+        assert users["new@example.com"].id == new_id
+        assert set(users) == {"existing@example.com", "new@example.com"}
+        assert users["existing@example.com"].plan == "admin"
+        assert users["new@example.com"].plan == "admin"
+        assert users["new@example.com"].plan_renews_at is not None
+
+
+def test_magic_token_roundtrip_and_rejects_tampering(monkeypatch):
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from app import create_app
+    from app.auth import services
+
+    app = create_app()
+    with app.app_context():
+        token = services.make_magic_token("first.last@example.com")
+        assert services.load_magic_token(token) == "first.last@example.com"
+
+        tampered = ("A" if token[0] != "A" else "B") + token[1:]
+        assert services.load_magic_token(tampered) is None
+        assert services.load_magic_token("not a token") is None
+
+        real_time = services.time.time
+        monkeypatch.setattr(
+            services.time, "time", lambda: real_time() + services.MAGIC_TOKEN_TTL_S + 1
+        )
+        assert services.load_magic_token(token) is None
+
+
+def test_load_user_by_email_uses_cached_id_and_survives_deletion():
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from app import create_app
+    from app.auth import services
+    from app.db import db
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email="cached@example.com"))
+        db.session.commit()
+
+        user = services.load_user_by_email(db.session, "cached@example.com")
+        assert user is not None
+        assert services._cached_user_id("cached@example.com") == user.id
+
+        db.session.delete(user)
+        db.session.commit()
+        assert services.load_user_by_email(db.session, "cached@example.com") is None
+        assert services._cached_user_id("cached@example.com") is None
+
+
+def test_normalize_email_strips_lowercases_and_interns():
+    from app.auth.services import normalize_email
+
+    assert normalize_email("  Foo@Example.COM \n") == "foo@example.com"
+    assert normalize_email("") == normalize_email("   ") == normalize_email(None) == ""
+    assert normalize_email("A@b.co") is normalize_email(" a@B.CO")
+
+
+def test_password_policy_rejects_long_passwords_quickly():
+    import time
+
+    from app.auth.services import HAS_UPPER_RE, PASSWORD_MAX_LEN, password_meets_policy
+
+    assert password_meets_policy("Secret!23")
+    assert not password_meets_policy("secret!23")
+    assert not password_meets_policy("S!" + "a" * PASSWORD_MAX_LEN)
+
+    no_upper = "a!" * 500_000
+    started = time.perf_counter()
+    assert not password_meets_policy(no_upper)
+    # The pattern itself must stay linear, whatever the length cap
+    assert HAS_UPPER_RE.search(no_upper) is None
+    assert time.perf_counter() - started < 0.5
+
+
+def test_upsert_oauth_user_creates_or_fills_in_existing_user():
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from datetime import datetime, timezone
+
+    from app import create_app
+    from app.auth.services import upsert_oauth_user
+    from app.db import db
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email="known@example.com", display_name="Known", password_hash="x"))
+        db.session.commit()
+
+        now = datetime.now(timezone.utc)
+        common = {"provider": "google", "given_name": "Given", "full_name": "Full Name", "now": now}
+        known_id = upsert_oauth_user(
+            db.session, sub="sub-1", email="known@example.com", display_name="Given",
+            picture="http://img/1", **common,
+        )
+        new_id = upsert_oauth_user(
+            db.session, sub="sub-2", email="new@example.com", display_name="Given",
+            picture=None, **common,
+        )
+        db.session.commit()
+        db.session.expire_all()
+
+        known = db.session.get(User, known_id)
+        assert known.email == "known@example.com"
+        assert known.display_name == "Known"
+        assert known.full_name == "Full Name"
+        assert known.email_verified_at is not None
+        assert known.oauth_provider is None
+
+        new = db.session.get(User, new_id)
+        assert (new.email, new.oauth_provider, new.oauth_sub) == ("new@example.com", "google", "sub-2")
+        assert new.email_verified_at is not None
+
+
+def test_find_oauth_user_returns_identity_and_email_owner_in_one_lookup():
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from app import create_app
+    from app.auth.services import find_oauth_user
+    from app.db import db
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        linked = User(email="linked@example.com", oauth_provider="google", oauth_sub="sub-1")
+        other = User(email="other@example.com", password_hash="x")
+        db.session.add_all([linked, other])
+        db.session.commit()
+
+        user, owner_id = find_oauth_user(db.session, provider="google", sub="sub-1", email="other@example.com")
+        assert user is linked
+        assert owner_id == other.id
+
+        user, owner_id = find_oauth_user(db.session, provider="linkedin", sub="sub-1", email="new@example.com")
+        assert (user, owner_id) == (None, None)
+
+
+def test_verify_password_accepts_legacy_hashes_and_flags_them_for_rehash():
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+
+    from werkzeug.security import generate_password_hash
+
+    from app import create_app
+    from app.auth import services
+
+    app = create_app()
+    app.config["AUTH_PW_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    with app.app_context():
+        current = services.hash_password("Secret!23")
+        assert services.verify_password(current, "Secret!23")
+        assert not services.verify_password(current, "wrong")
+        assert not services.password_needs_rehash(current)
+
+        legacy = generate_password_hash("Secret!23", method="pbkdf2:sha256:2000")
+        assert services.verify_password(legacy, "Secret!23")
+        assert services.password_needs_rehash(legacy)
+        # Same algorithm, different cost: a prefix match must not count as current
+        stronger = generate_password_hash("Secret!23", method="pbkdf2:sha256:10000")
+        assert services.password_needs_rehash(stronger)
+        assert not services.verify_password(None, "Secret!23")